@@ -20,18 +20,23 @@
 
 
 import numpy as np
-import SMESH
+import common
+import meshBackend
+import meshSnapshot
+import meshTopology
 
 class MeshQualityCheck:
 
-  def __init__(self, MESH, nonOrthThreshold = None, skewThreshold = None):
+  def __init__(self, MESH, nonOrthThreshold = None, skewThreshold = None, chunkSize = 100000):
     self.mesh = MESH
+    self.chunkSize = chunkSize #faces processed at once
     
     self.nonOrthogonalityCheck = True
     self.skewnessCheck = True
     
     self.outputPreSting = "MeshQualityCheck:\t\t"
-    self.sharedFaceDict = {}
+    self.snapshot = None
+    self.internalFaceNodes = None
     self.nbInternalFaces = 0
 
     self.orthAngle = None
@@ -41,7 +46,7 @@ class MeshQualityCheck:
     self.avSkew = 0
     self.maxSkew = 0
     
-    self.salomeid_to_idhere = {}
+    self.idhere_to_salomeid = None
     self.face_normal = None
     self.cell_center = None
     self.cell_center_vector = None
@@ -56,34 +61,21 @@ class MeshQualityCheck:
     
   ### MESH CHECK FUNCTION ###
   def buildInternalFaces(self):
-    volIDs = self.mesh.GetElementsByType( SMESH.VOLUME )
-    for v in volIDs:
-      nbF = self.mesh.ElemNbFaces( v )
-      for f in range(0,nbF):
-        vFNodes = self.mesh.GetElemFaceNodes( v, f )
-        dictKey = tuple(sorted(vFNodes))
-        try:
-          self.sharedFaceDict[ dictKey ][1] = v
-          self.nbInternalFaces += 1
-        except:
-          self.sharedFaceDict[ dictKey ] = [v , 0]
+    self.snapshot = meshSnapshot.snapshotFromMesh(self.mesh, verbose=False)
+    faceNodes = meshTopology.csrToPadded(self.snapshot.faceNodesOffsets,
+                                         self.snapshot.faceNodes)
+    internalFaces, owner, neighbour, boundaryFaces = \
+        meshTopology.buildFaceTopology(faceNodes, self.snapshot.getFaceCells())
+    self.internalFaceNodes = faceNodes[internalFaces]
+    self.nbInternalFaces = len(internalFaces)
     #0 based index for mesh element
-    count = 0
-    self.idhere_to_salomeid = {}
-    for v in volIDs:
-      self.salomeid_to_idhere[v] = count
-      self.idhere_to_salomeid[count] = v
-      count += 1
-    self.sharedFaceDict = {x:y for x,y in self.sharedFaceDict.items() if y[1]}
-    self.connections = np.array([[self.salomeid_to_idhere[x], self.salomeid_to_idhere[y]]
-                                 for x,y in self.sharedFaceDict.values()], dtype='i8')
+    self.idhere_to_salomeid = self.snapshot.cellIds
+    self.connections = np.stack([owner, neighbour], axis=1)
     return
   
   def compute_cell_center(self):
-    volIDs = self.mesh.GetElementsByType( SMESH.VOLUME )
-    self.cell_center = np.zeros((len(volIDs), 3), dtype='f8')
-    for i,v in enumerate(volIDs):
-      self.cell_center[i] = self.mesh.BaryCenter(v)
+    #same as Salome BaryCenter()
+    self.cell_center = self.snapshot.getCellBaryCenters()
     return
     
   def compute_unit_cell_center_vector(self):
@@ -94,17 +86,19 @@ class MeshQualityCheck:
     return
     
   def compute_face_normal(self):
-    self.vertices = np.zeros((self.mesh.NbNodes(), 3), dtype='f8')
-    for i,v in enumerate(self.mesh.GetNodesId()):
-      self.vertices[i,:] = self.mesh.GetNodeXYZ(v)
-    self.face_normal = np.zeros((self.nbInternalFaces,3), dtype='f8')
-    for i,face_vs in enumerate(self.sharedFaceDict.keys()):
-      u = self.vertices[face_vs[1]-1] - self.vertices[face_vs[0]-1] #Warning, contiguous numbering
-      v = self.vertices[face_vs[2]-1] - self.vertices[face_vs[1]-1]
-      n = np.cross(u,v)
-      self.face_normal[i] = n / np.linalg.norm(n)
+    #Newell normal, valid for non planar faces
+    self.vertices = self.snapshot.vertices
+    self.face_normal = common.computeFacesGeometry(self.vertices, 
+                         self.internalFaceNodes, self.chunkSize)[2]
     return
     
+  def compute_face_center(self, start, end):
+    #average of the face vertices
+    nodes = self.internalFaceNodes[start:end]
+    mask = nodes >= 0
+    center = (self.vertices[nodes] * mask[:,:,np.newaxis]).sum(axis=1)
+    return center / mask.sum(axis=1)[:,np.newaxis]
+    
   def checkMesh(self):
     print("\n")
     print(self.outputPreSting + "checking mesh")
@@ -127,30 +121,27 @@ class MeshQualityCheck:
     # 4. compute orthogonality angle
     print(self.outputPreSting + "compute orthogonality angle")
     #both face_normal and cell_center_vector are unitary
-    dot = self.face_normal[:,0] * self.cell_center_vector[:,0] \
-          + self.face_normal[:,1] * self.cell_center_vector[:,1] \
-          + self.face_normal[:,2] * self.cell_center_vector[:,2]
+    dot = np.einsum('ij,ij->i', self.face_normal, self.cell_center_vector)
     #correct floating point error
-    dot[dot > 1.] = 1.
-    dot[dot < -1.] = -1
+    np.clip(dot, -1., 1., out=dot)
     self.orthAngle = np.arccos(np.abs(dot)) * 180 / np.pi
     self.avNonOrth = np.mean(self.orthAngle)
     self.maxNonOrth = np.max(self.orthAngle)
     
     # 5. compute skewness
     print(self.outputPreSting + "compute skewness")
-    face_center = np.zeros((self.nbInternalFaces, 3), dtype='f8')
-    for i,f_vs in enumerate(self.sharedFaceDict.keys()):
-      f_vs = [x-1 for x in f_vs]
-      face_center[i] = np.sum(self.vertices[f_vs,:],axis=0) / len(f_vs)
-    w = face_center - self.cell_center[self.connections[:,0]]
-    s = (self.face_normal[:,0] * w[:,0] + self.face_normal[:,1] * w[:,1] 
-           + self.face_normal[:,2] * w[:,2])
-    s /= (self.face_normal[:,0] * self.cell_center_vector[:,0] \
-          + self.face_normal[:,1] * self.cell_center_vector[:,1] \
-          + self.face_normal[:,2] * self.cell_center_vector[:,2])
-    P = self.cell_center[self.connections[:,0]] + s[:,np.newaxis]*self.cell_center_vector
-    self.skewness = np.linalg.norm(face_center - P, axis=1) / self.cell_center_distance
+    self.skewness = np.zeros(self.nbInternalFaces, dtype='f8')
+    for start in range(0, self.nbInternalFaces, self.chunkSize):
+      end = min(start+self.chunkSize, self.nbInternalFaces)
+      face_center = self.compute_face_center(start, end)
+      normal = self.face_normal[start:end]
+      vector = self.cell_center_vector[start:end]
+      owner_center = self.cell_center[self.connections[start:end,0]]
+      w = face_center - owner_center
+      s = np.einsum('ij,ij->i', normal, w) / dot[start:end]
+      P = owner_center + s[:,np.newaxis] * vector
+      self.skewness[start:end] = np.linalg.norm(face_center - P, axis=1) / \
+                                 self.cell_center_distance[start:end]
     self.avSkew = np.mean(self.skewness)
     self.maxSkew = np.max(self.skewness)
  
@@ -168,26 +159,21 @@ class MeshQualityCheck:
    
    
   ### GROUP CREATION ###
+  def getCellsAbove(self, values, threshold):
+    #Salome ids of the cells sharing a face with a value above threshold
+    cells = np.unique(self.connections[values > threshold])
+    return self.idhere_to_salomeid[cells].tolist()
+    
   def createNonOrthGroup(self, value):
-    volToAdd = set()
-    for i,angle in enumerate(self.orthAngle):
-      if angle > value:
-        ids = self.connections[i]
-        volToAdd.add(self.idhere_to_salomeid[ids[0]])
-        volToAdd.add(self.idhere_to_salomeid[ids[1]])
-    interimGroup = self.mesh.GetMesh().CreateGroup(SMESH.VOLUME, "Non-orthogonality > " + str(value) )
-    interimGroup.Add(list(volToAdd))
+    volToAdd = self.getCellsAbove(self.orthAngle, value)
+    interimGroup = self.mesh.GetMesh().CreateGroup(meshBackend.VOLUME, "Non-orthogonality > " + str(value) )
+    interimGroup.Add(volToAdd)
     return
     
   def createSkewGroup(self, value):
-    volToAdd = set()
-    for i,skew in enumerate(self.skewness):
-      if skew > value:
-        ids = self.connections[i]
-        volToAdd.add(self.idhere_to_salomeid[ids[0]])
-        volToAdd.add(self.idhere_to_salomeid[ids[1]])
-    interimGroup = self.mesh.GetMesh().CreateGroup(SMESH.VOLUME, "Skewness > " + str(value) )
-    interimGroup.Add(list(volToAdd))
+    volToAdd = self.getCellsAbove(self.skewness, value)
+    interimGroup = self.mesh.GetMesh().CreateGroup(meshBackend.VOLUME, "Skewness > " + str(value) )
+    interimGroup.Add(volToAdd)
     return
 
     
@@ -116,19 +116,41 @@ class EDZFractureNetwork:
     return K
   
   #
-  def computePermeability(self, distance, normal, makeRotation=True):
+  def __checkParameters__(self):
+    if self.model not in ['SNOW', 'MOURZENCKO_EDZ']:
+      raise ValueError('Model non defined')
+    if not self.initialDensity or not self.attenuationLength:
+      raise ValueError('Density function with distance not set')
+    if not self.radius or not self.aperture:
+      raise ValueError('Fracture properties not set')
+    return
+  
+  def computePermeability(self, distance, normal, makeRotation=True, blockSize=100000):
+    """
+    Return the permeability tensor components Kxx, Kxy, Kxz, Kyy, Kyz, Kzz
+    at distance from the wall, normal being the direction to the wall.
+    Arrays are processed by blocks of blockSize cells written in a
+    preallocated output. Raise ValueError if the model or its parameters
+    are not set
+    """
+    self.__checkParameters__()
+    if np.ndim(distance) == 0:
+      return self.__computePermeabilityBlock__(distance, normal, makeRotation)
+    K = np.empty((6,len(distance)), dtype='f8')
+    for start in range(0, len(distance), blockSize):
+      end = min(start+blockSize, len(distance))
+      block = self.__computePermeabilityBlock__(distance[start:end], 
+                None if normal is None else normal[start:end], makeRotation)
+      for i,Ki in enumerate(block):
+        K[i,start:end] = Ki
+    return tuple(K)
     
+  def __computePermeabilityBlock__(self, distance, normal, makeRotation=True):
+    #parameters checked by computePermeability
     #compute density
-    if not self.initialDensity or not self.attenuationLength:
-      print('Density function with distance not set')
-      raise ValueError('')
     rho = self.initialDensity * np.exp(-distance/self.attenuationLength)
     
     #compute perm
-    if not self.radius or not self.aperture:
-      print('Fracture properties not set')
-      raise ValueError('')
-      
     if self.model == 'SNOW':
       K = rho*np.pi*self.radius*self.radius*self.aperture**3/18
       
@@ -142,9 +164,6 @@ class EDZFractureNetwork:
       #convert to dimentional permeability
       K = K_r * self.aperture**3 / 12 / self.radius
       #print(K, K_r, rho_r, l_r)
-    else:
-      print('Model non defined')
-      return
     
     if not self.iso: 
       Kperp = K/self.__phi__(self.concentrationParameter, l_r) 
@@ -178,40 +197,19 @@ class EDZFractureNetwork:
   
   #rotation
   def __rotatePermeabilityTensor__(self, Kperp, Kpara, normal_):
-    #found another vector perpendicular
-    #random we don't care as kxx=kyy
-    norm = np.linalg.norm(normal_, axis=1)
-    norm[norm < 1e-6] = 1.
-    n = normal_/ norm[:, np.newaxis]
-    testVector1 = np.ones((len(normal_),3), dtype="f8")
-    testVector2 = np.ones((len(normal_),3), dtype="f8")
-    testVector2[:,1] = 2
-    testVector1 = np.cross(n,testVector1)
-    testVector2 = np.cross(n,testVector2)
-    u = np.where(np.linalg.norm(testVector1) > np.linalg.norm(testVector2), testVector1, testVector2)
-    norm = np.linalg.norm(u, axis=1)
-    norm[norm < 1e-6] = 1.
-    u = u/norm[:, np.newaxis]
-    v = np.cross(n,u) #we have thus u.v = normal
-    
-    #u, v, normal are the basis vector
-    #P*K
-    Kxx = u[:,0]**2*Kperp + v[:,0]**2*Kperp + n[:,0]**2*Kpara
-    Kxy = u[:,0]*u[:,1]*Kperp + v[:,0]*v[:,1]*Kperp + n[:,0]*n[:,1]*Kpara
-    Kxz = u[:,0]*u[:,2]*Kperp + v[:,0]*v[:,2]*Kperp + n[:,0]*n[:,2]*Kpara
-    Kyy = u[:,1]**2*Kperp + v[:,1]**2*Kperp + n[:,1]**2*Kpara
-    Kyz = u[:,1]*u[:,2]*Kperp + v[:,1]*v[:,2]*Kperp + n[:,1]*n[:,2]*Kpara
-    Kzz = u[:,2]**2*Kperp + v[:,2]**2*Kperp + n[:,2]**2*Kpara
-    
-    #base change matrix P
-    #we got the local coordinate expressed in the simulation base
-    #P is the matrix with local vector coordinate expressed in simulation base in column
-    #and X_sim = P X_local
-    #P = np.append(np.array([u]).T,np.array([v]).T,axis=1)
-    #P = np.append(P,np.array([normal]).T,axis=1)
-    #K = P @ K @ P.T
-    #return Kperp, Kperp, Kperp, Kperp, Kperp, Kpara
-    return Kxx, Kxy, Kxz, Kyy, Kyz, Kzz
+    #K = Kperp * I + (Kpara - Kperp) * n n^T with n the unit normal
+    #(Kperp in the plane of the wall, Kpara along n)
+    #null normal (cell center on the wall) give an isotropic tensor
+    norm = np.sqrt(np.einsum('ij,ij->i', normal_, normal_))
+    norm[norm < 1e-6] = np.inf
+    n = normal_ / norm[:, np.newaxis]
+    dK = np.subtract(Kpara, Kperp)
+    K = np.empty((6,len(normal_)), dtype='f8')
+    for k,(i,j) in enumerate([(0,0),(0,1),(0,2),(1,1),(1,2),(2,2)]):
+      np.multiply(n[:,i], n[:,j], out=K[k])
+      K[k] *= dK
+      if i == j: K[k] += Kperp
+    return tuple(K)
   
   
   #Mourzencko function
@@ -22,6 +22,7 @@
 import EDZ_permeability_dataset_GUI
 import importlib
 import EDZFN_class
+import EDZ_sweep
 #importlib.reload(EDZ_permeability_dataset_GUI)
 
 import salome
@@ -30,9 +31,13 @@ from qtsalome import QDialog, QFileDialog
 import SMESH
 import GEOM
 
+import os
 import h5py
 import time
+import hashlib
 import common
+import meshSnapshot
+import surfaceDistance
 import numpy as np
 
 
@@ -52,62 +57,140 @@ def computeNodePositionFromSurface(mesh, surface, elementNumber, point, geompy):
   
 
 
-def createDistanceAndNormalDataset(mesh, surface, output):
-  
-  smesh = salome.smesh.smeshBuilder.New()
+def computeFingerprint(*arrays):
+  """
+  Hash of the content of arrays, identifying the inputs of a distance dataset
+  """
+  h = hashlib.sha1()
+  for x in arrays:
+    x = np.ascontiguousarray(x)
+    h.update(str(x.dtype).encode())
+    h.update(str(x.shape).encode())
+    h.update(x.tobytes())
+  return h.hexdigest()
+
+
+
+def openDistanceDataset(output, cellNumber, surfaceFaces, chunkSize=100000, resume=False,
+                        cutoff=np.inf, fingerprint=""):
+  """
+  Open the distance and normal dataset file. If resume and output is a
+  dataset computed for the same number of cells, surface faces, cutoff and
+  input fingerprint (see computeFingerprint), it is opened to continue after
+  its last completed chunk, else a new file is created. Return the file and
+  the number of cells already computed
+  """
+  attrs = {"Cell number":cellNumber, "Surface faces":surfaceFaces, "Cutoff":cutoff,
+           "Fingerprint":fingerprint}
+  if resume and os.path.isfile(output) and h5py.is_hdf5(output):
+    out = h5py.File(output, mode='r+')
+    if ("Completed cells" in out.attrs and 
+        all(k in out.attrs and out.attrs[k] == v for k,v in attrs.items())):
+      done = int(out.attrs["Completed cells"])
+      #drop a chunk written after the last checkpoint
+      if len(out["Distance"]) != done:
+        out["Distance"].resize((done,))
+      if len(out["Normal"]) != done:
+        out["Normal"].resize((done,3))
+      return out, done
+    out.close()
+    print(f"Warning: {output} was computed for other inputs, it is recomputed")
+  out = h5py.File(output, mode='w')
+  for k,v in attrs.items():
+    out.attrs[k] = v
+  out.attrs["Completed cells"] = 0
+  if not cellNumber: #nothing to append, h5py rejects empty chunks
+    out.create_dataset('Distance', shape=(0,), dtype='f8')
+    out.create_dataset('Normal', shape=(0,3), dtype='f8')
+    return out, 0
+  chunks = min(chunkSize, cellNumber)
+  out.create_dataset('Distance', shape=(0,), maxshape=(cellNumber,), dtype='f8', 
+                     chunks=(chunks,))
+  out.create_dataset('Normal', shape=(0,3), maxshape=(cellNumber,3), dtype='f8', 
+                     chunks=(chunks,3))
+  return out, 0
+
+
+
+def createDistanceAndNormalDataset(mesh, surface, output, n_workers=1, 
+                                   chunkSize=100000, resume=False, sparse=False,
+                                   cutoff=None):
+  """
+  Compute for each cell of mesh the distance from its center to the surface
+  group and the vector to the closest point of the surface. Cells not in
+  mesh (if a group) get a distance of -1, or are not written if sparse.
+  Cells farther than cutoff from the surface get an infinite distance.
+  Cells are processed by chunks of chunkSize in n_workers processes, each
+  chunk being appended to output as soon as completed. If resume, a
+  previous interrupted computation in output is continued
+  """
   fatherMesh = mesh.GetMesh()
-  
-  fatherCells = fatherMesh.GetElementsByType(SMESH.VOLUME)
-  fatherCellNumber = len(fatherMesh.GetElementsByType(SMESH.VOLUME))
+  snapshot = meshSnapshot.snapshotFromMesh(fatherMesh, verbose=False)
+  fatherCellNumber = snapshot.getCellNumber()
   if isinstance(mesh,salome.smesh.smeshBuilder.meshProxy):
-    cellsToExport = set(fatherMesh.GetElementsByType(SMESH.VOLUME))
+    cellsToExport = np.ones(fatherCellNumber, dtype=bool)
   if (isinstance(mesh,SMESH._objref_SMESH_Group) or
       isinstance(mesh,SMESH._objref_SMESH_GroupOnGeom) or
       isinstance(mesh,SMESH._objref_SMESH_GroupOnFilter)):
-    cellsToExport = set(mesh.GetIDs())
-  cellNumber = len(cellsToExport)
+    cellsToExport = np.isin(snapshot.cellIds, mesh.GetIDs())
+  cellNumber = np.count_nonzero(cellsToExport)
+  #father mesh rows written in output
+  if sparse:
+    rows = np.nonzero(cellsToExport)[0]
+  else:
+    rows = np.arange(fatherCellNumber)
+  if cutoff is None: cutoff = np.inf
   
   #init groups
-  int_type = np.log(cellNumber)/np.log(2)/8
-  if int_type <= 1: int_type = 'u1'
-  elif int_type <= 2: int_type = 'u2'
-  elif int_type <= 4: int_type = 'u4'
-  else: int_type = 'u8'
-  cellIds = np.zeros(fatherCellNumber, dtype=int_type)
-  D = np.zeros(fatherCellNumber, dtype='f8')
-  normal = np.zeros((fatherCellNumber,3), dtype='f8')
+  #smallest unsigned type holding the largest id
+  cellIds = (rows + 1).astype(np.min_scalar_type(fatherCellNumber))
   
-  #create a new temp mesh to keep the cell center's
-  temp_mesh = smesh.Mesh()
+  #surface triangles
+  if surface.GetMesh().GetId() == fatherMesh.GetId():
+    surfaceSnapshot = snapshot
+  else:
+    surfaceSnapshot = meshSnapshot.snapshotFromMesh(surface.GetMesh(), verbose=False)
+  faceNodes = surfaceSnapshot.getFaceElemNodes(surface.GetIDs())
+  engine = surfaceDistance.SurfaceDistance(surfaceSnapshot.vertices, faceNodes)
+  print(f"Distance of {cellNumber} cells to {engine.getTriangleNumber()} surface triangles")
   
-  count_progress = 0
-  for count, cellId in enumerate(fatherCells):
-    if cellId in cellsToExport:
-      #print progression
-      count_progress += 1
-      #common.progress_bar(count_progress, cellNumber, barLength=50) #does not work
-      if not count_progress % 2000: print(f"{count_progress} / {len(cellsToExport)}")
-      #compute cell center and add to temp_mesh_obj
-      X,Y,Z = fatherMesh.BaryCenter(cellId)
-      node_id = temp_mesh.AddNode(X,Y,Z)
-      #compute distance and normal
-      measure = smesh.GetMinDistance(temp_mesh, surface, node_id, 0, isElem1=False, isElem2=False)
-      D[count] = measure.value
-      normal[count] = [measure.minX, measure.minY, measure.minZ]
-      temp_mesh.RemoveNodes([node_id])
-    else:
-      D[count] = -1
-    cellIds[count] = count+1
-    count += 1
-     
-  #write output
-  out = h5py.File(output, mode='w')
-  out.create_dataset('Cell Ids', data=cellIds)
-  out.create_dataset('Distance', data=D)
-  out.create_dataset('Normal', data=normal)
-  out.close()
+  #distance from cell centers (Salome BaryCenter())
+  centers = snapshot.getCellBaryCenters()[rows]
+  inGroup = cellsToExport[rows]
   
-  smesh.RemoveMesh(temp_mesh)
+  n_rows = len(rows)
+  #cells, centers and surface the distances are computed for
+  surfaceNodes = np.unique(faceNodes[faceNodes >= 0])
+  fingerprint = computeFingerprint(snapshot.cellIds[rows], inGroup, centers,
+                                   np.asarray(surface.GetIDs()), faceNodes,
+                                   surfaceSnapshot.vertices[surfaceNodes])
+  out, done = openDistanceDataset(output, n_rows, len(faceNodes), chunkSize, resume, 
+                                  cutoff, fingerprint)
+  if done: print(f"Resume after {done} / {n_rows} cells")
+  if 'Cell Ids' not in out:
+    out.create_dataset('Cell Ids', data=cellIds)
+  
+  starts = range(done, n_rows, chunkSize)
+  chunks = (centers[start:start+chunkSize][inGroup[start:start+chunkSize]] 
+            for start in starts)
+  tt = time.time()
+  for start, (distance, vector) in zip(starts, 
+                surfaceDistance.queryChunks(engine, chunks, n_workers, cutoff)):
+    end = min(start+chunkSize, n_rows)
+    mask = inGroup[start:end]
+    D = np.full(end-start, -1., dtype='f8')
+    D[mask] = distance
+    normal = np.zeros((end-start,3), dtype='f8')
+    normal[mask] = vector
+    out["Distance"].resize((end,))
+    out["Distance"][start:end] = D
+    out["Normal"].resize((end,3))
+    out["Normal"][start:end] = normal
+    #checkpoint
+    out.attrs["Completed cells"] = end
+    out.flush()
+    print(f"{end} / {n_rows} cells ({(end-done)/(time.time()-tt):.0f} cells/s)")
+  out.close()
   
   print('\n')
   
@@ -115,6 +198,11 @@ def createDistanceAndNormalDataset(mesh, surface, output):
   
   
 def computePermeabilityDataset(output, EDZClass, name, new_h5_file_name=''):
+  """
+  Compute the permeability datasets from the distance and normal datasets.
+  Cells out of the group (distance -1) or beyond the cutoff distance (inf)
+  get the matrix permeability without evaluating the EDZ model
+  """
   src = h5py.File(output, mode='r+')
   distance = np.array(src["Distance"])
   normal = np.array(src["Normal"]) 
@@ -125,15 +213,10 @@ def computePermeabilityDataset(output, EDZClass, name, new_h5_file_name=''):
   else:
     out = src
   
-  if EDZClass.getAnisotropy(): #anisotropic EDZ
-    K = EDZClass.computePermeability(distance, normal)
-    groupsName = ('X','XY','XZ','Y','YZ','Z')
-    for i,Ki in enumerate(K):
-      out.create_dataset(name +groupsName[i], data=Ki)
-      
-  else:
-    K = EDZClass.computePermeability(distance, normal)[0]
-    out.create_dataset(name + '_ISO', data=K)
+  inEDZ = (distance >= 0) & np.isfinite(distance)
+  print(f"EDZ permeability computed for {np.count_nonzero(inEDZ)} / {cellNumber} cells")
+  K = EDZ_sweep.computePermeabilityTensor(EDZClass, distance, normal)
+  EDZ_sweep.writePermeabilityDataset(out, name, K, EDZClass.getAnisotropy())
     
   src.close()
   return
@@ -146,6 +229,7 @@ def EDZPermeabilityDataset(context):
   
   importlib.reload(EDZ_permeability_dataset_GUI)
   importlib.reload(EDZFN_class)
+  importlib.reload(EDZ_sweep)
   sg = context.sg
   smesh = smeshBuilder.New()
   
@@ -326,22 +410,19 @@ def EDZPermeabilityDataset(context):
     #print(mesh, surface, output, model, anisoFactor, radius, aperture, attenuationLength, matrixCoupling, matrixPerm)
     
     #EDZ properties
-    EDZClass = EDZFN_class.EDZFractureNetwork()
-    EDZClass.setEDZModel(model)
-    if window.enableAnisoBool: EDZClass.setAnisotropy(anisoFactor)
-    EDZClass.setFractureProperties(radius,aperture)
-    EDZClass.setAttenuationLength(attenuationLength)
-    EDZClass.setMatrixPermeability(matrixPerm)
-    EDZClass.setMatrixCoupling(matrixCoupling)
-    #compute initial density from traceLength
-    initialDensity = EDZClass.computeInitialDensityFromTraceLength(traceLength)
-    EDZClass.setInitialDensity(initialDensity)
+    EDZClass = EDZ_sweep.createEDZFractureNetwork(model, traceLength, 
+                 attenuationLength, radius, aperture, matrixPerm, 
+                 anisoFactor if window.enableAnisoBool else None, matrixCoupling)
     EDZClass.printReducedParameter()
     
     #create normal and distance dataset
     print("Create distance to surface and normal dataset")
     tt=time.time()
-    createDistanceAndNormalDataset(mesh, surface, output)
+    #Mourzenko EDZ permeability is the matrix one beyond the hydraulic length
+    cutoff = None
+    if model == "MOURZENCKO_EDZ":
+      cutoff = EDZClass.computeHydraulicLength()
+    createDistanceAndNormalDataset(mesh, surface, output, resume=False, cutoff=cutoff)
     print ("Total time to compute geometrical information: {} seconds".format(time.time()-tt))
     
     #compute perm dataset
@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307 USA
+#
+# Author : Moise Rousseau (2021), email at moise.rousseau@polymtl.ca
+
+"""
+EDZ permeability datasets for many parameter sets from a single distance
+and normal dataset (created by createDistanceAndNormalDataset), without
+Salome, for example:
+
+  scenarios = {}
+  for l in [0.5, 1., 2.]:
+    scenarios[f"l{l}"] = createEDZFractureNetwork("MOURZENCKO_EDZ",
+                           traceLength=10., attenuationLength=l, radius=0.5,
+                           aperture=1e-4, matrixPerm=1e-18, anisotropy=2.)
+  sweepPermeabilityDatasets("distance.h5", scenarios, "sweep.h5", n_workers=3)
+
+writes the datasets Perm_l0.5X, Perm_l0.5XY, ... Perm_l2.0Z in sweep.h5
+"""
+
+import numpy as np
+import h5py
+import time
+import EDZFN_class
+
+
+
+def createEDZFractureNetwork(model, traceLength, attenuationLength, radius, aperture,
+                             matrixPerm, anisotropy=None, matrixCoupling=False):
+  """
+  Set up an EDZFractureNetwork as the permeability dataset dialog does, the
+  initial density being computed from the trace length
+  """
+  EDZClass = EDZFN_class.EDZFractureNetwork()
+  EDZClass.setEDZModel(model)
+  if anisotropy: EDZClass.setAnisotropy(anisotropy)
+  EDZClass.setFractureProperties(radius, aperture)
+  EDZClass.setAttenuationLength(attenuationLength)
+  EDZClass.setMatrixPermeability(matrixPerm)
+  EDZClass.setMatrixCoupling(matrixCoupling)
+  EDZClass.setInitialDensity(EDZClass.computeInitialDensityFromTraceLength(traceLength))
+  return EDZClass
+
+
+
+def computePermeabilityTensor(EDZClass, distance, normal):
+  """
+  Return the (6, n) permeability tensor components Kxx, Kxy, Kxz, Kyy, Kyz,
+  Kzz. Cells out of the group (distance -1) or beyond the cutoff distance
+  (inf) get the matrix permeability without evaluating the EDZ model
+  """
+  inEDZ = (distance >= 0) & np.isfinite(distance)
+  K = np.zeros((6,len(distance)), dtype='f8')
+  K[[0,3,5]] = EDZClass.getPermMatrix()
+  KEDZ = EDZClass.computePermeability(distance[inEDZ], normal[inEDZ])
+  for i,Ki in enumerate(KEDZ):
+    K[i,inEDZ] = Ki
+  return K
+
+
+
+def writePermeabilityDataset(out, name, K, anisotropic):
+  """
+  Write the datasets nameX, nameXY, ... nameZ if anisotropic, name_ISO else.
+  Datasets of a previous run with the same name are replaced
+  """
+  groupsName = ('X','XY','XZ','Y','YZ','Z')
+  for x in groupsName + ('_ISO',):
+    if name + x in out:
+      del out[name + x]
+  if anisotropic:
+    for i,Ki in enumerate(K):
+      out.create_dataset(name + groupsName[i], data=Ki)
+  else:
+    out.create_dataset(name + '_ISO', data=K[0])
+  return
+
+
+
+#distance and normal of the sweep worker processes
+workerData = {}
+
+def initSweepWorker(distance, normal):
+  workerData["distance"] = distance
+  workerData["normal"] = normal
+  return
+
+def computeScenario(EDZClass):
+  return computePermeabilityTensor(EDZClass, workerData["distance"], workerData["normal"])
+
+
+
+def sweepPermeabilityDatasets(distanceFile, scenarios, output, n_workers=1, prefix="Perm"):
+  """
+  Compute the permeability datasets of each scenario (a dict of name to
+  EDZFractureNetwork) from the Distance and Normal datasets of distanceFile,
+  read once. Scenarios are evaluated by n_workers processes and written as
+  <prefix>_<name> datasets in output, with the Cell Ids of distanceFile
+  """
+  src = h5py.File(distanceFile, mode='r')
+  cellIds = np.array(src["Cell Ids"])
+  distance = np.array(src["Distance"])
+  normal = np.array(src["Normal"])
+  cutoff = src.attrs["Cutoff"] if "Cutoff" in src.attrs else np.inf
+  src.close()
+  if len(distance) != len(cellIds):
+    raise RuntimeError(f"Incomplete distance dataset in {distanceFile}")
+
+  #distance beyond cutoff is not known, EDZ must vanish before
+  for name, EDZClass in scenarios.items():
+    if EDZClass.getModel() != "MOURZENCKO_EDZ" or EDZClass.computeHydraulicLength() > cutoff:
+      if np.isfinite(cutoff):
+        print(f"Warning: scenario {name} EDZ extends beyond the distance cutoff ({cutoff} m)")
+
+  out = h5py.File(output, mode='w')
+  out.create_dataset('Cell Ids', data=cellIds)
+  names = list(scenarios)
+  tt = time.time()
+  if n_workers <= 1:
+    initSweepWorker(distance, normal)
+    results = map(computeScenario, [scenarios[x] for x in names])
+    pool = None
+  else:
+    #distance and normal are sent once to each worker
+    import multiprocessing
+    pool = multiprocessing.Pool(n_workers, initSweepWorker, (distance, normal))
+    results = pool.imap(computeScenario, [scenarios[x] for x in names])
+  try:
+    for name, K in zip(names, results):
+      writePermeabilityDataset(out, f"{prefix}_{name}", K, scenarios[name].getAnisotropy())
+      print(f"Scenario {name} written ({time.time()-tt:.2f} s)")
+  finally:
+    if pool is not None:
+      pool.close()
+      pool.join()
+    workerData.clear()
+    out.close()
+  return
@@ -24,6 +24,7 @@ import os
 import importlib
 #import plugin component
 import common
+import exportSession
 import UI_Integral_flux
 importlib.reload(UI_Integral_flux)
 
@@ -38,8 +39,10 @@ import SMESH
 
 
 
-def exportSurfaceForIntegralFlux(meshToExport, dest, gridFormat, reverse = False, option = 0):
+def exportSurfaceForIntegralFlux(meshToExport, dest, gridFormat, reverse = False, option = 0, session = None):
   fatherMesh = meshToExport.GetMesh()
+  if session is None:
+    session = exportSession.ExportSession(fatherMesh, verbose=False)
   out = open(dest, 'w')
   elementList = meshToExport.GetIDs()
   if reverse: out.write("INVERT_DIRECTION\n")
@@ -50,10 +53,10 @@ def exportSurfaceForIntegralFlux(meshToExport, dest, gridFormat, reverse = False
   
   if gridFormat == 1: #COOR_AND_NORMAL
     out.write("COORDINATES_AND_DIRECTIONS\n")
-    for elem in elementList:
-      nodes = fatherMesh.GetElemNodes(elem)
-      center = common.computeCenterFromNodeList(nodes, fatherMesh)
-      normal = common.getNormalFromNodeList(nodes, fatherMesh)
+    snapshot = session.getSnapshot()
+    faceNodes = snapshot.getFaceElemNodes(elementList)
+    areas, centers, normals = common.computeFacesGeometry(snapshot.vertices, faceNodes)
+    for center, normal in zip(centers.tolist(), normals.tolist()):
       out.write("  ")
       center = [str(x) for x in center]
       out.write(" ".join(center) + " ")
@@ -69,21 +72,20 @@ def exportSurfaceForIntegralFlux(meshToExport, dest, gridFormat, reverse = False
       out.write('\n')
       
   elif gridFormat == 3: #CELL_IDS
-    #need to build correspondance between PFLOTRAN ID and Salome ID
-    fatherElems = fatherMesh.GetElementsByType(SMESH.VOLUME)
-    corresp = {fatherElems[i]:i+1 for i in range(len(fatherElems))}
     out.write("CELL_IDS\n")
-    for elem in elementList:
-      nodes = fatherMesh.GetElemNodes(elem)
-      elems = fatherMesh.GetElementsByNodes(nodes, SMESH.VOLUME)
-      normal = common.getNormalFromNodeList(nodes, fatherMesh)
-      test = np.array(fatherMesh.BaryCenter(elems[1]))
-      test -= fatherMesh.GetNodeXYZ(nodes[0])
-      if np.dot(normal,test) < 0: elems.reverse()
-      elems = [str(corresp[x]) for x in elems]
-      out.write("  ")
-      out.write(" ".join(elems))
-      out.write('\n')
+    snapshot = session.getSnapshot()
+    faceNodes, owner, neighbour = session.getFaceElemCells(elementList)
+    if (neighbour == -1).any():
+      out.close()
+      raise RuntimeError("Some faces of the surface are not shared by two volumes")
+    #second cell on the side of the face normal
+    normals = common.computeFacesGeometry(snapshot.vertices, faceNodes)[2]
+    test = snapshot.getCellBaryCenters()[neighbour] - snapshot.vertices[faceNodes[:,0]]
+    swap = np.einsum('ij,ij->i', normals, test) < 0
+    first = np.where(swap, neighbour, owner) + 1
+    second = np.where(swap, owner, neighbour) + 1
+    for cells in zip(first.tolist(), second.tolist()):
+      out.write("  %s %s\n" %cells)
       
   out.write("/")
   out.close()
@@ -255,12 +257,18 @@ def integralFluxExport(context):
     
     #Export selected meshes
     if len(meshesToExport) > 1:
+      #share the father mesh data between surfaces
+      sessions = {}
       for meshToExport in meshesToExport:
+        fatherMesh = meshToExport.GetMesh()
+        if fatherMesh.GetId() not in sessions:
+          sessions[fatherMesh.GetId()] = exportSession.ExportSession(fatherMesh, verbose=False)
         name = meshToExport.GetName()
         print ("Create surface integral file: " + name)
         file_name = dest + name + ".txt"
         exportSurfaceForIntegralFlux(meshToExport, file_name, 
-                                     gridFormat, reverse, option)
+                                     gridFormat, reverse, option,
+                                     sessions[fatherMesh.GetId()])
     else:
       print ("Create surface integral file: " + meshesToExport[0].GetName())
       exportSurfaceForIntegralFlux(meshesToExport[0], dest, gridFormat, reverse, option)
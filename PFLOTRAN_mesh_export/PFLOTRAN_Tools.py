@@ -32,6 +32,7 @@ except:
 #import plugin component
 import exportMesh
 import exportSubMesh
+import exportSession
 import UI_PFLOTRAN_Tools
 #reload it to make modification reloaded
 importlib.reload(exportMesh)
@@ -339,7 +340,8 @@ def PFLOTRANMeshExport(context):
     
     #Export selected meshes
     print ("Export mesh: " + meshToExport.GetName())
-    success = exportMesh.meshToPFLOTRAN(meshToExport, folder, outFormat, gridFormat, name, forceFullCalculation)
+    session = exportSession.ExportSession(meshToExport)
+    success = exportMesh.meshToPFLOTRAN(meshToExport, folder, outFormat, gridFormat, name, forceFullCalculation, session=session)
     #if not success: 
     #  print("Some error happen and the mesh have not been exported correctly...")
     #  return
@@ -347,9 +349,16 @@ def PFLOTRANMeshExport(context):
     #retrieve submesh
     if groupsToExport:
       print ("%s group(s) to export: " %len(groupsToExport))    
-      for (group,groupName) in groupsToExport:
-        print(groupName)
-        exportSubMesh.submeshToPFLOTRAN(group, groupName, folder, name, outFormat, gridFormat)
+      if outFormat == HDF5 and gridFormat == IMPLICIT:
+        #all regions in one HDF5 session
+        h5Options = {}
+        if forceFullCalculation:
+          h5Options = {"compression":"gzip", "shuffle":True}
+        exportSubMesh.regionsToPFLOTRANHDF5(groupsToExport, folder+name, session, **h5Options)
+      else:
+        for (group,groupName) in groupsToExport:
+          print(groupName)
+          exportSubMesh.submeshToPFLOTRAN(group, groupName, folder, name, outFormat, gridFormat, session=session)
     else:
       print("There is no group to export")
     
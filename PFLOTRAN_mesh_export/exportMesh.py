@@ -20,86 +20,155 @@
 
 
 import sys
-import salome
-import SMESH
 import numpy as np
 import gc
+import time
 import common
+import meshSnapshot
+import exportSession
+import meshTopology
 import depreciated
 import importlib
 importlib.reload(common)
+importlib.reload(meshSnapshot)
+importlib.reload(exportSession)
+importlib.reload(meshTopology)
 
 try:
   import h5py
 except:
   pass
+try:
+  import SMESH
+except ImportError: #NumPy backend only
+  SMESH = None
 
 
 #########
 # UTILS #
 #########
     
-def salomeToPFLOTRANNodeOrder(elementNumber, mesh):
+#SMESH entity type to snapshot cell type
+ENTITY_TO_CELL_TYPE = {}
+if SMESH is not None:
+  ENTITY_TO_CELL_TYPE = {
+    SMESH.Entity_Tetra : meshSnapshot.TETRA,
+    SMESH.Entity_Pyramid : meshSnapshot.PYRAMID,
+    SMESH.Entity_Penta : meshSnapshot.PENTA,
+    SMESH.Entity_Hexa : meshSnapshot.HEXA,
+    SMESH.Entity_Polyhedra : meshSnapshot.POLYHEDRA,
+  }
+PFLOTRAN_NODE_ORDER = meshSnapshot.PFLOTRAN_NODE_ORDER
+#snapshot cell type to XDMF topology type
+XDMF_CELL_TYPES = {
+  meshSnapshot.TETRA : 6,
+  meshSnapshot.PYRAMID : 7,
+  meshSnapshot.PENTA : 8,
+  meshSnapshot.HEXA : 9,
+}
+
+    
+def salomeToPFLOTRANNodeOrder(nodes, cellType):
   """
   Convert element node list from Salome to PFLOTRAN order
+  nodes could also be a (n_elements, n_nodes) array of elements of the same
+  type, cellType is a SMESH.Entity_* or a meshSnapshot cell type
   """
-  nodes = mesh.GetElemNodes(elementNumber)
-  elemType = mesh.GetElementGeomType(elementNumber)
-  if elemType == SMESH.Entity_Tetra: #tetrahedron
-    nodes = [nodes[1],  nodes[0], nodes[2], nodes[3]]
-  elif elemType == SMESH.Entity_Pyramid: #pyramid
-    nodes = [nodes[0],  nodes[3], nodes[2], nodes[1], nodes[4]]
-  elif elemType == SMESH.Entity_Penta: #prism
-    nodes = [nodes[1],  nodes[0], nodes[2], nodes[4], nodes[3], nodes[5]]
-  elif elemType == SMESH.Entity_Hexa: #hexa
-    nodes = [nodes[0],  nodes[3], nodes[2], nodes[1], nodes[4],  nodes[7], nodes[6], nodes[5]]
-  elif elemType == SMESH.Entity_Polyhedra: #polyhedra
+  cellType = ENTITY_TO_CELL_TYPE.get(cellType, cellType)
+  if cellType == meshSnapshot.POLYHEDRA: #polyhedra
     print("Implicit grid does not support polyhedral mesh, but explicit does. Please switch to explicit format.")
     return []
-  else:
-    print("Warning: node order for given type {} not supported".format(elemType))
+  elif cellType not in PFLOTRAN_NODE_ORDER:
+    print("Warning: node order for given type {} not supported".format(cellType))
     print("I need to add quadratic elem type")
     return []
-  return nodes
+  return np.asarray(nodes)[...,PFLOTRAN_NODE_ORDER[cellType]]
   
 
-def buildInternalFaces(mesh, project_area=False):
+def getCellTypeHistogram(snapshot):
+  """
+  Return the number of cells of each type and print the mesh composition
+  Return None if the mesh contains types not supported by the implicit format
+  """
+  names = {meshSnapshot.TETRA:"tetrahedra", meshSnapshot.PYRAMID:"pyramids",
+           meshSnapshot.PENTA:"prisms", meshSnapshot.HEXA:"hexahedra"}
+  histogram = np.bincount(snapshot.cellTypes, minlength=meshSnapshot.HEXA+1)
+  for cellType in np.nonzero(histogram)[0]:
+    if cellType not in PFLOTRAN_NODE_ORDER:
+      salomeToPFLOTRANNodeOrder([], cellType) #print the error
+      return None
+  print("Cells: " + ", ".join([f"{histogram[x]} {y}" for x,y in names.items() 
+                               if histogram[x]]))
+  return histogram
+
+
+def getPFLOTRANCells(snapshot, start, end, width):
+  """
+  Return cells start to end as rows [number of nodes, nodes in PFLOTRAN order]
+  padded with 0 to width, node ids starting at 1
+  """
+  types = snapshot.cellTypes[start:end]
+  cells = np.zeros((end-start, width), dtype='i8')
+  for cellType, order in PFLOTRAN_NODE_ORDER.items():
+    rows = np.nonzero(types == cellType)[0]
+    if not len(rows): continue
+    first = snapshot.cellNodesOffsets[start+rows]
+    cells[rows,0] = cellType
+    cells[rows,1:cellType+1] = snapshot.cellNodes[first[:,np.newaxis] + order] + 1
+  return cells
+
+
+def formatArray(fmt, array):
+  """
+  Format each row of a 2D array with fmt in a single string operation
+  """
+  return ((fmt + '\n') * len(array)) % tuple(array.ravel().tolist())
+  
+
+def createH5Dataset(out, name, shape, dtype, chunkSize=100000, compression=None,
+                    compressionLevel=4, shuffle=False):
+  """
+  Create an empty chunked HDF5 dataset to be filled by blocks
+  compression could be None, "gzip" or "lzf"
+  """
+  options = {}
+  if shape[0]:
+    options["chunks"] = (min(chunkSize, shape[0]),) + tuple(shape[1:])
+  if compression:
+    options["compression"] = compression
+    options["shuffle"] = shuffle
+    if compression == "gzip":
+      options["compression_opts"] = compressionLevel
+  return out.create_dataset(name, shape=shape, dtype=dtype, **options)
+
+
+def printH5DatasetStats(dataset, writeTime):
+  storage = dataset.id.get_storage_size()
+  ratio = dataset.size * dataset.dtype.itemsize / storage if storage else 1.
+  print(f"\n{dataset.name}: written in {writeTime:.2f} s, compression ratio {ratio:.2f}")
+  return
+  
+
+def buildInternalFaces(snapshot, project_area=False, faceNodes=None, n_workers=1):
+  """
+  Find the faces shared by two cells and compute their area and center
+  (in n_workers processes)
+  Return owner and neighbour cell indexes, face areas and centers
+  """
   #project_area = True #uncomment to compute projected instead of true area
-  sharedFaceDict = {}
-  volIDs = mesh.GetElementsByType( SMESH.VOLUME )
-  count_bar = 0
-  n_elements = len(volIDs)
-  faceArea = {}
-  faceCenter = {}
-  n_faces = 0
-  for v in volIDs:
-    count_bar += 1
-    if not count_bar % 100:
-      common.progress_bar(count_bar, n_elements, barLength=50)
-    nbF = mesh.ElemNbFaces( v )
-    for f in range(0,nbF):
-      vFNodes = mesh.GetElemFaceNodes( v, f )
-      dictKey = tuple(sorted(vFNodes))
-      b = False
-      try:
-        sharedFaceDict[ dictKey ].append( v )
-        b = True
-      except:
-        sharedFaceDict[ dictKey ] = [ v ]
-      if b:
-        b = False
-        n_faces += 1
-        area = common.computeAreaFromNodeList(vFNodes,mesh)
-        faceCenter[ dictKey ] = common.computeCenterFromNodeList(vFNodes,mesh)
-        if project_area:
-          faceNormal = common.getNormalFromNodeList(vFNodes, mesh)
-          cellCenterVector = common.computeCellCenterVectorFromCellIds(
-                                                sharedFaceDict[ dictKey ], mesh)
-          cellCenterVector /= np.linalg.norm(cellCenterVector)
-          faceArea[ dictKey ] = area * np.dot(faceNormal, cellCenterVector)
-        else:
-          faceArea[ dictKey ] = area
-  return n_faces, sharedFaceDict, faceArea, faceCenter
+  if faceNodes is None:
+    faceNodes = meshTopology.csrToPadded(snapshot.faceNodesOffsets, snapshot.faceNodes)
+  internalFaces, owner, neighbour, boundaryFaces = \
+           meshTopology.buildFaceTopology(faceNodes, snapshot.getFaceCells())
+  faceArea, faceCenter, faceNormal = common.computeFacesGeometryParallel(
+                     snapshot.vertices, faceNodes[internalFaces], n_workers)
+  if project_area:
+    cellCenters = snapshot.getCellBaryCenters()
+    #face normals are outward of the owner cell
+    cellCenterVector = cellCenters[neighbour] - cellCenters[owner]
+    cellCenterVector /= np.linalg.norm(cellCenterVector, axis=1)[:,np.newaxis]
+    faceArea *= np.einsum('ij,ij->i', faceNormal, cellCenterVector)
+  return owner, neighbour, faceArea, faceCenter
 
 
 
@@ -109,40 +178,52 @@ def buildInternalFaces(mesh, project_area=False):
 ### MAIN DRIVER ###
 ###################
 
-def meshToPFLOTRAN(meshToExport, activeFolder, outputFileFormat, outputMeshFormat, name=None, compressH5Output = False, fullCalculation=False):
+def meshToPFLOTRAN(meshToExport, activeFolder, outputFileFormat, outputMeshFormat, name=None, compressH5Output = False, fullCalculation=False,
+                   compression="gzip", compressionLevel=4, shuffle=True, chunkSize=100000,
+                   n_workers=1, session=None):
   """
   Main driver for Salome to PFLOTRAN mesh conversion
+  HDF5 datasets are written by chunks of chunkSize rows, and if 
+  compressH5Output is True, compressed with compression ("gzip" with 
+  compressionLevel from 0 to 9 or "lzf") with or without shuffle filter
+  Explicit grid connection geometry is computed with n_workers processes
+  session is an exportSession.ExportSession to share the mesh data with the
+  group exports
   """
-  n_nodes = meshToExport.NbNodes()
-  n_elements = len(meshToExport.GetElementsByType(SMESH.VOLUME))
-  nodesList = iter(range(1,n_nodes+1))
-  elementsList = iter(meshToExport.GetElementsByType(SMESH.VOLUME))
+  if session is None:
+    session = exportSession.ExportSession(meshToExport)
+  snapshot = session.getSnapshot()
   success = 0
   
   PFlotranOutput = activeFolder + name
   if outputFileFormat == 2: #ASCII
     if outputMeshFormat == 1: #Implicit
-      success = meshToPFLOTRANUntructuredASCII(meshToExport, n_nodes, n_elements, nodesList, elementsList, PFlotranOutput)
+      success = meshToPFLOTRANUntructuredASCII(snapshot, PFlotranOutput)
     elif outputMeshFormat == 2: #Explicit
-      domain_file = '.'.join(PFlotranOutput.split('.')[:-1]) + "_Domain.h5"
-      meshToXDMFWhenExplicit(meshToExport, n_nodes, n_elements, nodesList, 
-                             elementsList, domain_file)
-      success = meshToPFLOTRANUnstructuredExplicitASCII(meshToExport, PFlotranOutput)
+      success = meshToPFLOTRANExplicit(snapshot, PFlotranOutput, outputFileFormat,
+                                       n_workers=n_workers)
     elif outputMeshFormat == 3: #Polyhedra
-      success = meshToPFLOTRANUnstructuredPolyhedraASCII(meshToExport, PFlotranOutput)
+      success = meshToPFLOTRANUnstructuredPolyhedraASCII(snapshot, PFlotranOutput,
+                                                         chunkSize=chunkSize)
       
   elif outputFileFormat == 1: #HDF5
     if outputMeshFormat == 1: #Implicit
-      success = meshToPFLOTRANUnstructuredHDF5(meshToExport, n_nodes, \
-                                               n_elements, nodesList, \
-                                               elementsList, PFlotranOutput, \
-                                               compressH5Output)
+      h5Options = {"chunkSize":chunkSize}
+      if compressH5Output:
+        h5Options.update({"compression":compression, "shuffle":shuffle,
+                          "compressionLevel":compressionLevel})
+      success = meshToPFLOTRANUnstructuredHDF5(snapshot, PFlotranOutput, \
+                                               **h5Options)
     elif outputMeshFormat == 2: #Explicit
-      meshToPFLOTRANUnstructuredExplicitHDF5(meshToExport, PFlotranOutput)
-      domain_file = '.'.join(PFlotranOutput.split('.')[:-1]) + "_Domain.h5"
-      meshToXDMFWhenExplicit(meshToExport, n_nodes, n_elements, nodesList, elementsList, domain_file, mode="w")
+      success = meshToPFLOTRANExplicit(snapshot, PFlotranOutput, outputFileFormat,
+                                       n_workers=n_workers)
     elif outputMeshFormat == 3: #Polyhedra
-      success = meshToPFLOTRANUnstructuredPolyhedraHDF5(meshToExport, PFlotranOutput)
+      h5Options = {"chunkSize":chunkSize}
+      if compressH5Output:
+        h5Options.update({"compression":compression, "shuffle":shuffle,
+                          "compressionLevel":compressionLevel})
+      success = meshToPFLOTRANUnstructuredPolyhedraHDF5(snapshot, PFlotranOutput,
+                                                        **h5Options)
     
   return success
   
@@ -154,92 +235,90 @@ def meshToPFLOTRAN(meshToExport, activeFolder, outputFileFormat, outputMeshForma
 # UNSTRUCTURED GRID FORMAT EXPORT #
 ###################################
 
-def meshToPFLOTRANUntructuredASCII(meshToExport, n_nodes, n_elements, nodesList, elementsList, PFlotranOutput):
+def meshToPFLOTRANUntructuredASCII(snapshot, PFlotranOutput, chunkSize=100000):
   """
   Export a Salome mesh as PFLOTRAN implicit unstructured grid in ASCII
+  Lines are formatted and written by blocks of chunkSize elements or vertices
   """
-  #open pflotran file
-  out = open(PFlotranOutput, 'w')
+  n_nodes = snapshot.getNodeNumber()
+  n_elements = snapshot.getCellNumber()
   #initiate 3D element type
   elementCode = {4:'T', 5:'P', 6:'W', 8:'H'}
+  histogram = getCellTypeHistogram(snapshot)
+  if histogram is None: return 0 #fail
+  width = np.nonzero(histogram)[0].max() + 1
+  #open pflotran file
+  out = open(PFlotranOutput, 'w')
   #pflotran line 1
   out.write(str(n_elements) + ' ' + str(n_nodes) + '\n')
   #pflotran line 2 to n_element_3D +1
-  for i in elementsList:
-    elementNode = salomeToPFLOTRANNodeOrder(i, meshToExport)
-    if not elementNode: return 0 #fail
-    out.write(elementCode[len(elementNode)] + ' ')
-    for x in elementNode: #write
-      out.write(str(x) + ' ')
-    out.write('\n')
+  for start in range(0, n_elements, chunkSize):
+    end = min(start+chunkSize, n_elements)
+    cells = getPFLOTRANCells(snapshot, start, end, width)
+    lines = np.empty(end-start, dtype=object)
+    for cellType, code in elementCode.items():
+      rows = np.nonzero(cells[:,0] == cellType)[0]
+      if not len(rows): continue
+      nodes = cells[rows,1:cellType+1]
+      lines[rows] = formatArray(code + ' %d'*cellType + ' ', nodes).split('\n')[:-1]
+    out.write('\n'.join(lines) + '\n')
   #pflotran line n_element+1 to end
   #write node coordinates
-  for i in nodesList:
-    X,Y,Z = meshToExport.GetNodeXYZ(i)
-    out.write("{} {} {}\n".format(X,Y,Z))
+  for start in range(0, n_nodes, chunkSize):
+    out.write(formatArray("%r %r %r", snapshot.vertices[start:start+chunkSize]))
   out.close()
   return 0 #success
     
     
 
-def meshToPFLOTRANUnstructuredHDF5(meshToExport, n_nodes, n_elements, nodesList, elementsList, PFlotranOutput, compress=False):
+def meshToPFLOTRANUnstructuredHDF5(snapshot, PFlotranOutput, chunkSize=100000,
+                                   compression=None, compressionLevel=4, 
+                                   shuffle=False):
   """
   Export a Salome mesh as PFLOTRAN implicit unstructured grid in HDF5
+  Datasets are filled by chunks so only one chunk is held in memory
   """
+  n_elements = snapshot.getCellNumber()
+  h5Options = {"chunkSize":chunkSize, "compression":compression, 
+               "compressionLevel":compressionLevel, "shuffle":shuffle}
   #open pflotran output file
   out = h5py.File(PFlotranOutput, mode='w')
     
   #initialise array
   #integer length
   int_type = 'i8'
-  #only linear element
-  if meshToExport.GetMeshInfo()[SMESH.Entity_Hexa]: #hexa
-    elementsArray = np.zeros((n_elements,9), dtype=int_type)
-  elif meshToExport.GetMeshInfo()[SMESH.Entity_Penta]: #prisms
-    elementsArray = np.zeros((n_elements,7), dtype=int_type)
-  elif meshToExport.GetMeshInfo()[SMESH.Entity_Pyramid]: #pyr
-    elementsArray = np.zeros((n_elements,6), dtype=int_type)
-  elif meshToExport.GetMeshInfo()[SMESH.Entity_Tetra]: #tetra
-    elementsArray = np.zeros((n_elements,5), dtype=int_type)
-  #elif meshToExport.GetMeshInfo()[4]: #tri
-  #  elementsArray = np.zeros((n_elements,4), dtype=int_type)
-  else:
+  #only linear element, width given by the largest element present
+  histogram = getCellTypeHistogram(snapshot)
+  if histogram is None: 
+    out.close()
+    return 0 #fail
+  if not histogram.sum():
+    out.close()
     raise RuntimeError('No linear element of dimension 3 found.')
+  width = np.nonzero(histogram)[0].max() + 1
   
   #hdf5 element
-  count = 0
   print('Creating Domain/Cells dataset:')
-  for i in elementsList:
-    common.progress_bar(count, n_elements, barLength=50)
-    elementNode = salomeToPFLOTRANNodeOrder(i, meshToExport)
-    if not elementNode: return 0 #fail
-    elementsArray[count,0] = len(elementNode)
-    for j in range(len(elementNode)):
-      elementsArray[count,j+1] = elementNode[j]
-    count += 1
-  if compress:
-    out.create_dataset('Domain/Cells', data=elementsArray, 
-                       compression="gzip", compression_opts=9)
-  else:
-    out.create_dataset('Domain/Cells', data=elementsArray)
+  tt = time.time()
+  dataset = createH5Dataset(out, 'Domain/Cells', (n_elements,width), int_type,
+                            **h5Options)
+  for start in range(0, n_elements, chunkSize):
+    common.progress_bar(start, n_elements, barLength=50)
+    end = min(start+chunkSize, n_elements)
+    elementsArray = getPFLOTRANCells(snapshot, start, end, width)
+    dataset[start:end] = elementsArray
   del elementsArray
   gc.collect()
+  printH5DatasetStats(dataset, time.time()-tt)
   
   #hdf5 node coordinates
   print('\nCreating Domain/Vertices dataset: ')
-  vertexArray = np.zeros((n_nodes, 3), dtype='f8')
-  for i in nodesList:
-    X,Y,Z = meshToExport.GetNodeXYZ(i)
-    vertexArray[i-1,0] = X
-    vertexArray[i-1,1] = Y
-    vertexArray[i-1,2] = Z
-  if compress:
-    out.create_dataset('Domain/Vertices', data=vertexArray, 
-                       compression="gzip", compression_opts=9)
-  else:
-    out.create_dataset('Domain/Vertices', data=vertexArray)
-  del vertexArray
-  gc.collect()
+  tt = time.time()
+  n_nodes = snapshot.getNodeNumber()
+  dataset = createH5Dataset(out, 'Domain/Vertices', (n_nodes,3), 'f8', **h5Options)
+  for start in range(0, n_nodes, chunkSize):
+    dataset[start:start+chunkSize] = snapshot.vertices[start:start+chunkSize]
+  printH5DatasetStats(dataset, time.time()-tt)
   
   out.close()
   return 0 #success
@@ -252,66 +331,118 @@ def meshToPFLOTRANUnstructuredHDF5(meshToExport, n_nodes, n_elements, nodesList,
 # UNSTRUCTURED EXPLICIT GRID FORMAT EXPORT #
 ############################################
 
-def meshToPFLOTRANUnstructuredExplicitASCII(mesh, PFlotranOutput, center0DElem=True,
+def computeExplicitCells(snapshot, center0DElem=True, faceNodes=None):
+  """
+  Compute volume and center of every cell from the snapshot faces
+  Center is the 0D element of the cell if present, the cell centroid else
+  """
+  if faceNodes is None:
+    faceNodes = meshTopology.csrToPadded(snapshot.faceNodesOffsets, snapshot.faceNodes)
+  volumes, centers = common.computeCellsVolumeAndCenter(snapshot.vertices, 
+                        faceNodes, snapshot.getFaceCells(), snapshot.getCellNumber(),
+                        reference=snapshot.getCellBaryCenters())
+  negative = volumes < 0.
+  if negative.any():
+    print(f"{negative.sum()} cells with inward oriented faces (negative volume), exporting absolute value instead")
+    volumes[negative] *= -1
+  if (center0DElem and snapshot.elem0DNodes is not None and 
+      len(snapshot.elem0DNodes) == snapshot.getCellNumber()):
+    centers = snapshot.getCellCenters(center0DElem)
+  return volumes, centers
+
+
+
+def buildExplicitGrid(snapshot, center0DElem=True, project_area=False, n_workers=1):
+  """
+  Extract once all the arrays needed by the explicit grid and domain files
+  Return cell volumes and centers, and connections owner, neighbour, area
+  and center
+  """
+  faceNodes = meshTopology.csrToPadded(snapshot.faceNodesOffsets, snapshot.faceNodes)
+  print("Compute cell volumes and centers")
+  volumes, centers = computeExplicitCells(snapshot, center0DElem, faceNodes)
+  print("Build connections between cells")
+  owner, neighbour, faceArea, faceCenter = buildInternalFaces(snapshot, 
+                                                  project_area, faceNodes, n_workers)
+  return volumes, centers, owner, neighbour, faceArea, faceCenter
+
+
+
+def meshToPFLOTRANExplicit(snapshot, PFlotranOutput, outputFileFormat, 
+                           center0DElem=True, project_area=False, n_workers=1):
+  """
+  Export the explicit grid (ASCII or HDF5) and its visualization domain file
+  from a single extraction of the mesh topology and geometry
+  Connection geometry is computed by n_workers processes
+  """
+  grid = buildExplicitGrid(snapshot, center0DElem, project_area, n_workers)
+  if outputFileFormat == 2: #ASCII
+    success = writeExplicitASCII(PFlotranOutput, *grid)
+  else:
+    success = writeExplicitHDF5(PFlotranOutput, *grid)
+  domain_file = '.'.join(PFlotranOutput.split('.')[:-1]) + "_Domain.h5"
+  meshToXDMFWhenExplicit(snapshot, domain_file, center0DElem, centers=grid[1])
+  return success
+
+
+
+def meshToPFLOTRANUnstructuredExplicitASCII(snapshot, PFlotranOutput, center0DElem=True,
                                             project_area = False):
   """
   Export a Salome mesh as PFLOTRAN explicit unstructured grid in ASCII
   """
-  #print("Note: We use Qhull to compute the element volume since Salome has a error (https://salome-platform.org/forum/forum_10/547695356/view). We build first the convex hull and then get the volume. Thus, for non convex polyhedra, the exported volume will be false. The Salome error should be corrected on its next release.\n")
-  
+  grid = buildExplicitGrid(snapshot, center0DElem, project_area)
+  return writeExplicitASCII(PFlotranOutput, *grid)
+
+
+
+def meshToPFLOTRANUnstructuredExplicitHDF5(snapshot, PFlotranOutput, center0DElem=True,
+                                            project_area = False):
+  """
+  Export a Salome mesh as PFLOTRAN explicit unstructured grid in HDF5
+  """
+  grid = buildExplicitGrid(snapshot, center0DElem, project_area)
+  return writeExplicitHDF5(PFlotranOutput, *grid)
+
+
+
+def writeExplicitASCII(PFlotranOutput, volumes, centers, owner, neighbour, 
+                       faceArea, faceCenter, chunkSize=100000):
+  """
+  Write PFLOTRAN explicit unstructured grid in ASCII
+  """
   #open pflotran output file
   out = open(PFlotranOutput, mode='w')
 
   #CELLS part
   print("Write cell ids, center and volume")
-  n_elements = len(mesh.GetElementsByType(SMESH.VOLUME))
+  n_elements = len(volumes)
   out.write("CELLS %s\n" %n_elements)
-  count = 1
-  corresp = {}
-  if center0DElem:
-    elem0Ds = mesh.GetElementsByType(SMESH.ELEM0D)
-    if not len(elem0Ds): center0DElem = False
-    
-  for count_center,i in enumerate(mesh.GetElementsByType(SMESH.VOLUME)):
-    #get info (center and volume)
-    if center0DElem:
-      node = mesh.GetElemNodes(elem0Ds[count_center])[0]
-      center = mesh.GetNodeXYZ(node)
-    else:
-      center = mesh.BaryCenter(i)
-    volume = mesh.GetVolume(i)
-    if volume < 0.:
-      #print("Negative cell volume for cell {}, use Qhull instead but volume could be false if cell is non-convex".format(i))
-      #error = True
-      #volume = common.computeVolumeFromNodeList(mesh.GetElemNodes(i),mesh)
-      print(f"Negative cell volume for cell {i}, exporting absolute value instead")
-      volume = -volume
-    #write info
-    out.write(f"{count} {center[0]:.6e} {center[1]:.6e} {center[2]:.6e} {volume:.6e}\n")
-    corresp[i]=count
-    count += 1
+  for start in range(0, n_elements, chunkSize):
+    end = min(start+chunkSize, n_elements)
+    data = np.column_stack([np.arange(start+1, end+1), centers[start:end], 
+                            volumes[start:end]])
+    out.write(formatArray("%d %.6e %.6e %.6e %.6e", data))
   
   #CONNECTIONS part
-  print("Build connections between cells")
-  n_faces, sharedFaceDict, faceArea, faceCenter = buildInternalFaces(mesh, project_area)
-  print('\nWrite connections')
+  print('Write connections')
+  n_faces = len(owner)
   out.write("CONNECTIONS {}\n".format(n_faces)) 
-  for keys, cellIds in sharedFaceDict.items():
-    if len(cellIds) != 2: continue
-    area = faceArea[keys]
-    center = faceCenter[keys]
-    id1,id2 = cellIds
-    out.write(f"{corresp[id1]} {corresp[id2]} {center[0]:.6e} {center[1]:.6e} {center[2]:.6e} {area:.6e}\n")
+  for start in range(0, n_faces, chunkSize):
+    end = min(start+chunkSize, n_faces)
+    data = np.column_stack([owner[start:end]+1, neighbour[start:end]+1, 
+                            faceCenter[start:end], faceArea[start:end]])
+    out.write(formatArray("%d %d %.6e %.6e %.6e %.6e", data))
    
   out.close()
   return 0
 
 
 
-def meshToPFLOTRANUnstructuredExplicitHDF5(mesh, PFlotranOutput, center0DElem=True,
-                                            project_area = False):
+def writeExplicitHDF5(PFlotranOutput, volumes, centers, owner, neighbour, 
+                      faceArea, faceCenter):
   """
-  Export a Salome mesh as PFLOTRAN explicit unstructured grid in HDF5
+  Write PFLOTRAN explicit unstructured grid in HDF5
   """
   print("\nWarning! PFLOTRAN explicit grid in HDF5 format not currently supported")
   print("Follow this pull request for more information:")
@@ -321,122 +452,102 @@ def meshToPFLOTRANUnstructuredExplicitHDF5(mesh, PFlotranOutput, center0DElem=Tr
   
   #CELLS part
   print("Write cell ids, center and volume")
-  n_elements = len(mesh.GetElementsByType(SMESH.VOLUME))
-  centers = np.zeros((n_elements,3), dtype='f8')
-  volumes = np.zeros(n_elements, dtype='f8')
-  count = 1
-  corresp = {}
-  if center0DElem:
-    elem0Ds = mesh.GetElementsByType(SMESH.ELEM0D)
-    if not len(elem0Ds): center0DElem = False
-    
-  for count_center,i in enumerate(mesh.GetElementsByType(SMESH.VOLUME)):
-    #get info (center and volume)
-    if center0DElem:
-      node = mesh.GetElemNodes(elem0Ds[count_center])[0]
-      center = mesh.GetNodeXYZ(node)
-    else:
-      center = mesh.BaryCenter(i)
-    volume = mesh.GetVolume(i)
-    if volume < 0.:
-      #print("Negative cell volume for cell {}, use Qhull instead but volume could be false if cell is non-convex".format(i))
-      #error = True
-      #volume = common.computeVolumeFromNodeList(mesh.GetElemNodes(i),mesh)
-      print(f"Negative cell volume for cell {i}, exporting absolute value instead")
-      volume = -volume
-    #write info
-    centers[count_center] = center
-    volumes[count_center] = volume
-    corresp[i]=count
-    count += 1
   out.create_dataset("Domain/Cells/Centers",data=centers)
   out.create_dataset("Domain/Cells/Volumes",data=volumes)
   
   #CONNECTIONS part
-  print("Build connections between cells")
-  n_faces, sharedFaceDict, faceArea, faceCenter = buildInternalFaces(mesh, project_area)
-  
-  ids = np.zeros((n_faces,2), dtype='i8')
-  areas = np.zeros(n_faces, dtype='f8')
-  centers = np.zeros((n_faces,3), dtype='f8')
-  
-  count = 0
-  for keys, cellIds in sharedFaceDict.items():
-    if len(cellIds) != 2: continue
-    areas[count] = faceArea[keys]
-    centers[count] = faceCenter[keys]
-    cellIds = [corresp[x] for x in cellIds]
-    ids[count] = cellIds
-    count += 1
-  
-  out.create_dataset("Domain/Connections/Areas", data=np.resize(areas,count))
-  out.create_dataset("Domain/Connections/Cell Ids", data=np.resize(ids,(count,2)))
-  out.create_dataset("Domain/Connections/Centers", data=np.resize(centers,(count,3)))
+  print("Write connections")
+  ids = np.stack([owner+1, neighbour+1], axis=1)
+  out.create_dataset("Domain/Connections/Areas", data=faceArea)
+  out.create_dataset("Domain/Connections/Cell Ids", data=ids)
+  out.create_dataset("Domain/Connections/Centers", data=faceCenter)
   
   out.close()
   return 0
 
 
-def meshToXDMFWhenExplicit(meshToExport, n_nodes, n_elements, nodesList, 
-                           elementsList, PFLOTRANOutput, center0DElem=True, 
-                           mode="w"):
+def getXDMFMixedTopology(snapshot):
+  """
+  Build the XDMF mixed topology stream of the mesh in a preallocated array:
+  native XDMF cells (type, nodes) for linear elements and
+  (16, number of faces, [face size, face nodes]) for polyhedra
+  """
+  n_elements = snapshot.getCellNumber()
+  n_nodes = np.diff(snapshot.cellNodesOffsets)
+  isPoly = ~np.isin(snapshot.cellTypes, list(XDMF_CELL_TYPES))
+  #exact size of each cell description
+  faceSizes = np.diff(snapshot.faceNodesOffsets)
+  faceCells = snapshot.getFaceCells()
+  polyFaces = np.nonzero(isPoly[faceCells])[0]
+  sizes = 1 + n_nodes
+  sizes[isPoly] = 2 + np.diff(snapshot.cellFacesOffsets)[isPoly] + \
+                  np.bincount(faceCells[polyFaces], weights=faceSizes[polyFaces],
+                              minlength=n_elements).astype('i8')[isPoly]
+  offsets = np.zeros(n_elements+1, dtype='i8')
+  np.cumsum(sizes, out=offsets[1:])
+  stream = np.empty(offsets[-1], dtype='i8')
+  
+  #linear elements
+  for cellType, xdmfType in XDMF_CELL_TYPES.items():
+    cells = np.nonzero(snapshot.cellTypes == cellType)[0]
+    if not len(cells): continue
+    stream[offsets[cells]] = xdmfType
+    nodes = snapshot.cellNodes[snapshot.cellNodesOffsets[cells][:,np.newaxis] + 
+                               meshSnapshot.VTK_NODE_ORDER[cellType]]
+    stream[offsets[cells][:,np.newaxis] + 1 + np.arange(cellType)] = nodes
+  
+  #polyhedra
+  cells = np.nonzero(isPoly)[0]
+  if len(cells):
+    stream[offsets[cells]] = 16
+    stream[offsets[cells]+1] = np.diff(snapshot.cellFacesOffsets)[cells]
+    #position of each face description in its cell
+    entries = faceSizes[polyFaces] + 1
+    local = np.cumsum(entries) - entries
+    first = np.searchsorted(polyFaces, snapshot.cellFacesOffsets[faceCells[polyFaces]])
+    local -= local[first]
+    facePos = offsets[faceCells[polyFaces]] + 2 + local
+    stream[facePos] = faceSizes[polyFaces]
+    #face nodes
+    counts = faceSizes[polyFaces]
+    shift = np.cumsum(counts) - counts
+    index = np.arange(counts.sum())
+    nodes = np.repeat(snapshot.faceNodesOffsets[polyFaces] - shift, counts) + index
+    stream[np.repeat(facePos + 1 - shift, counts) + index] = snapshot.faceNodes[nodes]
+  return stream
+
+
+
+def meshToXDMFWhenExplicit(snapshot, PFLOTRANOutput, center0DElem=True, 
+                           mode="w", centers=None):
   """
   Create the HDF5 file so that DOMAIN_FILENAME can use it for visualization purpose
+  centers could be given to reuse the cell centers of the explicit grid
   """
   print("\nCreate Domain file to use with DOMAIN_FILENAME for visualization")
+  n_elements = snapshot.getCellNumber()
   #open pflotran output file
   out = h5py.File(PFLOTRANOutput, mode=mode)
   
   #hdf5 node coordinates
   print('Creating Domain/Vertices dataset')
-  vertexArray = np.zeros((n_nodes, 3), dtype='f8')
-  for i in nodesList:
-    X,Y,Z = meshToExport.GetNodeXYZ(i)
-    vertexArray[i-1,0] = X
-    vertexArray[i-1,1] = Y
-    vertexArray[i-1,2] = Z
-  out.create_dataset('Domain/Vertices', data=vertexArray)
+  out.create_dataset('Domain/Vertices', data=snapshot.vertices)
   
   #HDF5 cells
   #initialise array
   #integer length
   print('Creating Domain/Cells dataset')
-  temp_list = []
-  for c in elementsList:
-    temp_list.append(16) #we say it is a polyhedron, whatever it is really
-    nbF = meshToExport.ElemNbFaces( c )
-    temp_list.append(nbF) #write number of face 
-    for f in range(0,nbF):
-      vFNodes = meshToExport.GetElemFaceNodes( c, f )
-      temp_list.append(len(vFNodes)) #write face length
-      temp_list.extend([x-1 for x in vFNodes])
-  out.create_dataset('Domain/Cells', data=np.array(temp_list, dtype='i8'))
+  out.create_dataset('Domain/Cells', data=getXDMFMixedTopology(snapshot))
   #write number of cell in attribute
   out["Domain/Cells"].attrs.create("Cell number", [n_elements], dtype='i8')
   
   #store cell center
   print('Creating Domain/[XC,YC,ZC] datasets\n')
-  XC = np.zeros(n_elements, dtype='f8')
-  YC = np.zeros(n_elements, dtype='f8')
-  ZC = np.zeros(n_elements, dtype='f8')
-  if center0DElem:
-    elem0Ds = meshToExport.GetElementsByType(SMESH.ELEM0D)
-    if not len(elem0Ds): center0DElem = False
-  for count_center,i in enumerate(meshToExport.GetElementsByType(SMESH.VOLUME)):
-    #get info (center and volume)
-    if center0DElem:
-      node = meshToExport.GetElemNodes(elem0Ds[count_center])[0]
-      X,Y,Z = meshToExport.GetNodeXYZ(node)
-    else:
-      X,Y,Z = meshToExport.BaryCenter(i)
-    #write info
-    XC[count_center] = X
-    YC[count_center] = Y
-    ZC[count_center] = Z
-  
-  out.create_dataset("Domain/XC", data=XC)
-  out.create_dataset("Domain/YC", data=YC)
-  out.create_dataset("Domain/ZC", data=ZC)
+  if centers is None:
+    centers = snapshot.getCellCenters(center0DElem)
+  out.create_dataset("Domain/XC", data=centers[:,0])
+  out.create_dataset("Domain/YC", data=centers[:,1])
+  out.create_dataset("Domain/ZC", data=centers[:,2])
   
   #store number of cells
   #out.create_dataset('Domain/Cell_number', data=np.array([n_elements], dtype="i8"))
@@ -451,8 +562,179 @@ def meshToXDMFWhenExplicit(meshToExport, n_nodes, n_elements, nodesList,
 # POLYHEDRAL GRID FORMAT EXPORT #
 ############################################
 
-def meshToPFLOTRANUnstructuredPolyhedraASCII(meshToExport, PFlotranOutput):
-  return 1
+def buildPolyhedraGrid(snapshot, center0DElem=True):
+  """
+  Extract the arrays of the polyhedra grid: cell volumes and centers,
+  vertices of each cell (CSR), face cells, areas and centers
+  Faces are the cell faces of the snapshot, face i+1 in the PFLOTRAN file
+  is the face i of the snapshot face list
+  """
+  faceNodes = meshTopology.csrToPadded(snapshot.faceNodesOffsets, snapshot.faceNodes)
+  print("Compute cell volumes and centers")
+  volumes, centers = computeExplicitCells(snapshot, center0DElem, faceNodes)
+  print("Compute face areas and centers")
+  faceArea, faceCenter, normals = common.computeFacesGeometry(snapshot.vertices, faceNodes)
+  del faceNodes, normals
+  faceCells = snapshot.getFaceCells()
+  #vertices of each cell from its faces
+  cells = np.repeat(faceCells, np.diff(snapshot.faceNodesOffsets))
+  order = np.lexsort((snapshot.faceNodes, cells))
+  cells, nodes = cells[order], snapshot.faceNodes[order]
+  keep = np.ones(len(cells), dtype=bool)
+  keep[1:] = (cells[1:] != cells[:-1]) | (nodes[1:] != nodes[:-1])
+  cellVertices = nodes[keep]
+  cellVerticesOffsets = np.zeros(snapshot.getCellNumber()+1, dtype='i8')
+  np.cumsum(np.bincount(cells[keep], minlength=snapshot.getCellNumber()),
+            out=cellVerticesOffsets[1:])
+  return (volumes, centers, cellVerticesOffsets, cellVertices, faceCells, 
+          faceArea, faceCenter)
+
+
+
+def formatRaggedArray(ints, intsOffsets, floats, intFmt="%d", floatFmt="%.6e"):
+  """
+  Format rows made of a variable number of integers (CSR) followed by
+  a fixed number of floats, rows of the same length are formatted at once
+  """
+  sizes = np.diff(intsOffsets)
+  lines = np.empty(len(sizes), dtype=object)
+  for size in np.unique(sizes):
+    rows = np.nonzero(sizes == size)[0]
+    data = np.column_stack([ints[intsOffsets[rows][:,np.newaxis] + np.arange(size)],
+                            floats[rows]])
+    fmt = " ".join([intFmt]*size + [floatFmt]*floats.shape[1])
+    lines[rows] = formatArray(fmt, data).split('\n')[:-1]
+  return '\n'.join(lines) + '\n'
+
+
+
+def getPolyhedraCellRows(snapshot, grid, start, end):
+  """
+  Integer part of the CELLS lines of cells start to end in CSR format:
+  cell id, number of faces, number of vertices, face ids, vertex ids
+  """
+  volumes, centers, cellVerticesOffsets, cellVertices = grid[:4]
+  facesOffsets = snapshot.cellFacesOffsets[start:end+1]
+  verticesOffsets = cellVerticesOffsets[start:end+1]
+  n_faces = np.diff(facesOffsets)
+  n_vertices = np.diff(verticesOffsets)
+  offsets = np.zeros(end-start+1, dtype='i8')
+  np.cumsum(3 + n_faces + n_vertices, out=offsets[1:])
+  ints = np.zeros(offsets[-1], dtype='i8')
+  ints[offsets[:-1]] = np.arange(start+1, end+1)
+  ints[offsets[:-1]+1] = n_faces
+  ints[offsets[:-1]+2] = n_vertices
+  faces = np.arange(facesOffsets[0], facesOffsets[-1])
+  index = np.repeat(offsets[:-1] + 3 - facesOffsets[:-1], n_faces) + faces
+  ints[index] = faces + 1
+  vertices = np.arange(verticesOffsets[0], verticesOffsets[-1])
+  index = np.repeat(offsets[:-1] + 3 + n_faces - verticesOffsets[:-1], n_vertices) + vertices
+  ints[index] = cellVertices[vertices] + 1
+  return ints, offsets
+
+
+
+def getPolyhedraFaceRows(snapshot, grid, start, end):
+  """
+  Integer part of the FACES lines of faces start to end in CSR format:
+  face id, cell id, number of vertices, vertex ids
+  """
+  faceCells = grid[4]
+  nodesOffsets = snapshot.faceNodesOffsets[start:end+1]
+  n_vertices = np.diff(nodesOffsets)
+  offsets = np.zeros(end-start+1, dtype='i8')
+  np.cumsum(3 + n_vertices, out=offsets[1:])
+  ints = np.zeros(offsets[-1], dtype='i8')
+  ints[offsets[:-1]] = np.arange(start+1, end+1)
+  ints[offsets[:-1]+1] = faceCells[start:end] + 1
+  ints[offsets[:-1]+2] = n_vertices
+  vertices = np.arange(nodesOffsets[0], nodesOffsets[-1])
+  index = np.repeat(offsets[:-1] + 3 - nodesOffsets[:-1], n_vertices) + vertices
+  ints[index] = snapshot.faceNodes[vertices] + 1
+  return ints, offsets
+
+
+
+def meshToPFLOTRANUnstructuredPolyhedraASCII(snapshot, PFlotranOutput, 
+                                             center0DElem=True, chunkSize=100000):
+  """
+  Export a Salome mesh as PFLOTRAN unstructured polyhedra grid in ASCII
+  CELLS: id, number of faces, number of vertices, face ids, vertex ids, 
+         center, volume
+  FACES: id, cell id, number of vertices, vertex ids, center, area
+  """
+  grid = buildPolyhedraGrid(snapshot, center0DElem)
+  volumes, centers, cellVerticesOffsets, cellVertices, faceCells, \
+    faceArea, faceCenter = grid
+  out = open(PFlotranOutput, 'w')
+  
+  print("Write cells")
+  n_elements = snapshot.getCellNumber()
+  out.write("CELLS %s\n" %n_elements)
+  for start in range(0, n_elements, chunkSize):
+    end = min(start+chunkSize, n_elements)
+    ints, offsets = getPolyhedraCellRows(snapshot, grid, start, end)
+    floats = np.column_stack([centers[start:end], volumes[start:end]])
+    out.write(formatRaggedArray(ints, offsets, floats))
+  
+  print("Write faces")
+  n_faces = len(faceCells)
+  out.write("FACES %s\n" %n_faces)
+  for start in range(0, n_faces, chunkSize):
+    end = min(start+chunkSize, n_faces)
+    ints, offsets = getPolyhedraFaceRows(snapshot, grid, start, end)
+    floats = np.column_stack([faceCenter[start:end], faceArea[start:end]])
+    out.write(formatRaggedArray(ints, offsets, floats))
   
-def meshToPFLOTRANUnstructuredPolyhedraHDF5(meshToExport, PFlotranOutput):
-  return 1
+  print("Write vertices")
+  n_nodes = snapshot.getNodeNumber()
+  out.write("VERTICES %s\n" %n_nodes)
+  for start in range(0, n_nodes, chunkSize):
+    out.write(formatArray("%r %r %r", snapshot.vertices[start:start+chunkSize]))
+  out.close()
+  return 0
+  
+
+
+def meshToPFLOTRANUnstructuredPolyhedraHDF5(snapshot, PFlotranOutput, 
+                                            center0DElem=True, chunkSize=100000,
+                                            compression=None, compressionLevel=4, 
+                                            shuffle=False):
+  """
+  Export a Salome mesh as unstructured polyhedra grid in HDF5, mirroring
+  the ASCII format with CSR connectivities (number of items per row + 
+  flat 1-based ids) written by chunks
+  """
+  print("\nWarning! PFLOTRAN polyhedra grid in HDF5 format may not be supported by your PFLOTRAN version")
+  grid = buildPolyhedraGrid(snapshot, center0DElem)
+  volumes, centers, cellVerticesOffsets, cellVertices, faceCells, \
+    faceArea, faceCenter = grid
+  h5Options = {"chunkSize":chunkSize, "compression":compression, 
+               "compressionLevel":compressionLevel, "shuffle":shuffle}
+  out = h5py.File(PFlotranOutput, mode='w')
+  
+  def writeArray(name, array):
+    tt = time.time()
+    dataset = createH5Dataset(out, name, array.shape, array.dtype, **h5Options)
+    for start in range(0, len(array), chunkSize):
+      dataset[start:start+chunkSize] = array[start:start+chunkSize]
+    printH5DatasetStats(dataset, time.time()-tt)
+    return
+  
+  print("Write cells")
+  writeArray("Domain/Cells/Number of Faces", np.diff(snapshot.cellFacesOffsets))
+  writeArray("Domain/Cells/Face Ids", np.arange(1, len(faceCells)+1, dtype='i8'))
+  writeArray("Domain/Cells/Number of Vertices", np.diff(cellVerticesOffsets))
+  writeArray("Domain/Cells/Vertex Ids", cellVertices + 1)
+  writeArray("Domain/Cells/Centers", centers)
+  writeArray("Domain/Cells/Volumes", volumes)
+  print("\nWrite faces")
+  writeArray("Domain/Faces/Cell Ids", faceCells + 1)
+  writeArray("Domain/Faces/Number of Vertices", np.diff(snapshot.faceNodesOffsets))
+  writeArray("Domain/Faces/Vertex Ids", snapshot.faceNodes + 1)
+  writeArray("Domain/Faces/Centers", faceCenter)
+  writeArray("Domain/Faces/Areas", faceArea)
+  print("\nWrite vertices")
+  writeArray("Domain/Vertices", snapshot.vertices)
+  out.close()
+  return 0
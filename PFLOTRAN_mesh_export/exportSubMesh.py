@@ -19,23 +19,30 @@
 
 
 
-import SMESH
 import numpy as np
-import salome
+import time
+import common
+import exportSession
+import exportMesh
+from meshBackend import VOLUME, FACE
 try:
   import h5py
 except:
   pass
 
 
-def submeshToPFLOTRAN(submesh, submeshName, activeFolder, meshFile=None, outputFileFormat=0, outputMeshFormat=0):
-  #Get mesh input type
-  if (isinstance(submesh,SMESH._objref_SMESH_Group) or
-      isinstance(submesh,SMESH._objref_SMESH_GroupOnGeom) or
-      isinstance(submesh,SMESH._objref_SMESH_GroupOnFilter)):
-    elementsList = iter(submesh.GetIDs())
-    n_elements = len(submesh.GetIDs())
-    maxElement = max(submesh.GetIDs())
+def submeshToPFLOTRAN(submesh, submeshName, activeFolder, meshFile=None, outputFileFormat=0, outputMeshFormat=0, session=None):
+  """
+  Export a group of the mesh as a PFLOTRAN region.
+  session is the exportSession.ExportSession of the father mesh, shared
+  between the group exports to avoid rebuilding the Salome to PFLOTRAN
+  cell id correspondance for each group
+  """
+  #Get mesh input type (Salome or NumPy backend group)
+  if hasattr(submesh, "GetIDs"):
+    elementsList = submesh.GetIDs()
+    n_elements = len(elementsList)
+    maxElement = max(elementsList)
   #elif isinstance(submesh,salome.smesh.smeshBuilder.submeshProxy):
   #  elementsList = iter(submesh.GetElementsId())
   #  n_elements = submesh.GetNumberOfElements()
@@ -44,24 +51,26 @@ def submeshToPFLOTRAN(submesh, submeshName, activeFolder, meshFile=None, outputF
   #submesh and father mesh type
   submeshType = submesh.GetTypes()[0]
   fatherMesh = submesh.GetMesh() #meshProxy object
-  if SMESH.VOLUME in fatherMesh.GetTypes():
-    fatherMeshType = SMESH.VOLUME
-  #elif SMESH.FACE in fatherMesh.GetTypes():
-  #  fatherMeshType = SMESH.FACE
+  if VOLUME in fatherMesh.GetTypes():
+    fatherMeshType = VOLUME
+  #elif FACE in fatherMesh.GetTypes():
+  #  fatherMeshType = FACE
   else:
     raise RuntimeError('Father mesh not VOLUME, STOP')
+  if session is None:
+    session = exportSession.ExportSession(fatherMesh)
     
     
   if outputMeshFormat == 1: #implicit
-    if submeshType == SMESH.VOLUME and fatherMeshType == SMESH.VOLUME:
+    if submeshType == VOLUME and fatherMeshType == VOLUME:
       if outputFileFormat == 1: #HDF5
-        volumeSubmeshAsRegionHDF5(submesh, elementsList, maxElement, n_elements,  activeFolder + meshFile, name=None)
+        volumeSubmeshAsRegionHDF5(submesh, elementsList, maxElement, n_elements,  activeFolder + meshFile, name=None, session=session)
       elif outputFileFormat == 2: #ASCII
-        volumeSubmeshAsRegionASCII(submesh, elementsList, n_elements, activeFolder+submeshName+'.vs')
-    elif submeshType == SMESH.FACE and fatherMeshType == SMESH.VOLUME:
+        volumeSubmeshAsRegionASCII(submesh, elementsList, n_elements, activeFolder+submeshName+'.vs', session=session)
+    elif submeshType == FACE and fatherMeshType == VOLUME:
       if outputFileFormat == 1: #HDF5
         surfaceSubmeshAsRegionHDF5(submesh, elementsList, n_elements, 
-                                   activeFolder+meshFile, submeshName)
+                                   activeFolder+meshFile, submeshName, session)
         #print('Exported as ' + activeFolder+submeshName+'.ss')
         #surfaceSubmeshAsRegionASCII(submesh, elementsList, n_elements, activeFolder+submeshName+'.ss')
       elif outputFileFormat == 2: #ASCII
@@ -69,35 +78,41 @@ def submeshToPFLOTRAN(submesh, submeshName, activeFolder, meshFile=None, outputF
       return 
       
   elif outputMeshFormat == 2: #explicit
-    if submeshType == SMESH.VOLUME and fatherMeshType == SMESH.VOLUME:
+    if submeshType == VOLUME and fatherMeshType == VOLUME:
       if outputFileFormat == 1: #HDF5
         print("Non implemented yet") 
-        volumeSubmeshAsRegionASCII(submesh, elementsList, n_elements, activeFolder+submeshName+'.vs')
+        volumeSubmeshAsRegionASCII(submesh, elementsList, n_elements, activeFolder+submeshName+'.vs', session=session)
       elif outputFileFormat == 2: #ASCII
-        volumeSubmeshAsRegionASCII(submesh, elementsList, n_elements, activeFolder+submeshName+'.vs')
-    elif submeshType == SMESH.FACE and fatherMeshType == SMESH.VOLUME:
+        volumeSubmeshAsRegionASCII(submesh, elementsList, n_elements, activeFolder+submeshName+'.vs', session=session)
+    elif submeshType == FACE and fatherMeshType == VOLUME:
       if outputFileFormat == 1: #HDF5
         print('Not implemented')
-        surfaceSubmeshUnstructuredExplicit(submesh, elementsList, n_elements,  activeFolder+submeshName+'.ex')
+        surfaceSubmeshUnstructuredExplicit(submesh, elementsList, n_elements,  activeFolder+submeshName+'.ex', session=session)
       elif outputFileFormat == 2: #ASCII
-        surfaceSubmeshUnstructuredExplicit(submesh, elementsList, n_elements,  activeFolder+submeshName+'.ex')
+        surfaceSubmeshUnstructuredExplicit(submesh, elementsList, n_elements,  activeFolder+submeshName+'.ex', session=session)
       return 
+      
+  elif outputMeshFormat == 3: #polyhedra, same cell ids as the explicit grid
+    if submeshType == VOLUME and fatherMeshType == VOLUME:
+      volumeSubmeshAsRegionASCII(submesh, elementsList, n_elements, activeFolder+submeshName+'.vs', session=session)
+    else:
+      print(f"Surface region {submeshName} not exported, not supported for polyhedra grid")
+    return
     
   return
 
 
 
-def volumeSubmeshAsRegionASCII(submesh, elementsList, n_element, ASCIIOutput, name=None):
+def volumeSubmeshAsRegionASCII(submesh, elementsList, n_element, ASCIIOutput, name=None, session=None):
+  if session is None:
+    session = exportSession.ExportSession(submesh.GetMesh())
   #open pflotran file
   out = open(ASCIIOutput, 'w')
   
-  #We need correspondance between mesh element in salome and in HDF5
-  fatherMeshCells = submesh.GetMesh().GetElementsByType(SMESH.VOLUME)
-  d = {fatherMeshCells[i]: i+1 for i in range(len(fatherMeshCells))}
-  
-  #grab element node list for each element and write it
-  for x in elementsList:
-    out.write(str(d[x])+'\n')
+  #correspondance between mesh element in salome and in PFLOTRAN
+  cellIds = session.getPFLOTRANCellIds(elementsList)
+  if len(cellIds):
+    out.write('\n'.join(map(str, cellIds.tolist())) + '\n')
   out.close()
   return
 
@@ -126,95 +141,125 @@ def surfaceSubmeshAsRegionASCII(submesh, elementsList, n_element, ASCIIOutput, n
   return
 
 
-def surfaceSubmeshAsRegionHDF5(submesh, elementsList, n_element, h5_output, name=None):
-  #open pflotran file
-  out = h5py.File(h5_output, 'r+')
-  
-  #size the array
-  nodesArray = np.zeros((n_element,5), dtype="u8")
-    
-  #populate array
-  for i,x in enumerate(elementsList):
-    nodesId = submesh.GetMesh().GetElemNodes(x)
-    if len(nodesId) == 3: nodesArray[i][0] = 3
-    elif len(nodesId) == 4: nodesArray[i][0] = 4
-    else:
-      print("Implicit grid type does not support face element with more than 4 nodes.")
-      print("You may try the explicit format mesh export.")
-      return
-    for j,nodeId in enumerate(nodesId):
-      nodesArray[i][j+1] = nodeId
-  
-  #output it
-  if "Regions" not in list(out.keys()): out.create_group('Regions')
-  out.create_dataset(f"Regions/{name}/Vertex Ids", data=nodesArray)
-  out.close()
+def surfaceSubmeshAsRegionHDF5(submesh, elementsList, n_element, h5_output, name=None, session=None):
+  if session is None:
+    session = exportSession.ExportSession(submesh.GetMesh())
+  if not name:
+    name = submesh.GetName()
+  regionsToPFLOTRANHDF5([[submesh, name]], h5_output, session)
   return
   
  
   
-def volumeSubmeshAsRegionHDF5(submesh, elementsList, maxElement, n_elements, PFlotranOutput, name=None):
+def volumeSubmeshAsRegionHDF5(submesh, elementsList, maxElement, n_elements, PFlotranOutput, name=None, session=None):
+  if session is None:
+    session = exportSession.ExportSession(submesh.GetMesh())
   
   #region name
   if not name:
-    name = salome.smesh.smeshBuilder.GetName(submesh)
-    
-  #open pflotran file
-  out = h5py.File(PFlotranOutput, 'r+')
-  try:
-    regionGroup = out["Regions"]
-  except:
-    regionGroup = out.create_group("Regions")
-  
-  #create region
-  submeshGroup = regionGroup.create_group(name)
-
-  int_type = np.log(submesh.GetMesh().GetElementsByType(SMESH.VOLUME).index(maxElement)+1)/np.log(2)/8
-  if int_type <= 1: int_type = 'u1'
-  elif int_type <= 2: int_type = 'u2'
-  elif int_type <= 4: int_type = 'u4'
-  else: int_type = 'u8'
-
-  #export the submesh
-  elementData = np.zeros(n_elements, dtype=int_type)
-  fatherMeshCells = submesh.GetMesh().GetElementsByType(SMESH.VOLUME)
-  #We need correspondance between mesh element in salome and in HDF5
-  d = {fatherMeshCells[i]: i+1 for i in range(len(fatherMeshCells))}
-  count = 0
-  for x in elementsList:
-    elementData[count] = d[x]
-    count += 1
-    
-  out.create_dataset('Regions/%s/Cell Ids' %name, data=elementData)
+    name = submesh.GetName()
+  regionsToPFLOTRANHDF5([[submesh, name]], PFlotranOutput, session)
+  return
+
+
+
+def getRegionCellIds(session, elementsList):
+  """
+  PFLOTRAN cell ids of a volume group in the smallest unsigned integer type
+  """
+  #correspondance between mesh element in salome and in HDF5
+  cellIds = session.getPFLOTRANCellIds(elementsList)
+  if not len(cellIds): #empty group, empty region
+    return cellIds.astype('u1')
+  #smallest unsigned type holding the largest id
+  return cellIds.astype(np.min_scalar_type(np.uint64(cellIds.max())))
 
+
+
+def getRegionVertexIds(session, elementsList):
+  """
+  Rows of [number of vertices, vertex ids] of a face group, None if the group
+  contains faces with more than 4 nodes
+  """
+  faceNodes = session.getSnapshot().getFaceElemNodes(elementsList)
+  sizes = (faceNodes != -1).sum(axis=1)
+  if faceNodes.shape[1] > 4 or (sizes < 3).any():
+    print("Implicit grid type does not support face element with more than 4 nodes.")
+    print("You may try the explicit format mesh export.")
+    return None
+  nodesArray = np.zeros((len(faceNodes),5), dtype="u8")
+  nodesArray[:,0] = sizes
+  nodesArray[:,1:faceNodes.shape[1]+1] = faceNodes + 1 #pad -1 become 0
+  return nodesArray
+
+
+
+def regionsToPFLOTRANHDF5(groups, PFlotranOutput, session, chunkSize=100000,
+                          compression=None, compressionLevel=4, shuffle=False):
+  """
+  Write many groups as PFLOTRAN regions in the HDF5 mesh file, opened once.
+  groups is a list of [group, region name], volume groups are written as 
+  Regions/<name>/Cell Ids, face groups as Regions/<name>/Vertex Ids, with the
+  chunk and compression settings of exportMesh.createH5Dataset
+  """
+  h5Options = {"chunkSize":chunkSize, "compression":compression, 
+               "compressionLevel":compressionLevel, "shuffle":shuffle}
+  tt = time.time()
+  out = h5py.File(PFlotranOutput, 'r+')
+  if "Regions" not in out: out.create_group("Regions")
+  for group, name in groups:
+    t_region = time.time()
+    elementsList = group.GetIDs()
+    groupType = group.GetTypes()[0]
+    if groupType == VOLUME:
+      datasetName = f"Regions/{name}/Cell Ids"
+      data = getRegionCellIds(session, elementsList)
+    elif groupType == FACE:
+      datasetName = f"Regions/{name}/Vertex Ids"
+      data = getRegionVertexIds(session, elementsList)
+    else:
+      data = None
+    if data is None:
+      print(f"Region {name} not exported")
+      continue
+    if datasetName in out: del out[datasetName]
+    dataset = exportMesh.createH5Dataset(out, datasetName, data.shape, 
+                                         data.dtype, **h5Options)
+    dataset[...] = data
+    print(f"Region {name}: {len(data)} elements written in {time.time()-t_region:.2f} s")
   out.close()
+  print(f"{len(groups)} region(s) exported in {time.time()-tt:.2f} s")
   return
 
 
 
 
-def surfaceSubmeshUnstructuredExplicit(submesh, elementList, n_elements, name=None):
+def surfaceSubmeshUnstructuredExplicit(submesh, elementList, n_elements, name=None, session=None):
+  if session is None:
+    session = exportSession.ExportSession(submesh.GetMesh())
   if not name:
-    name = salome.smesh.smeshBuilder.GetName(submesh)
+    name = submesh.GetName()
   
   out = open(name, 'w')
   out.write("CONNECTIONS {}\n".format(n_elements))
   
-  smesh = salome.smesh.smeshBuilder.New()
-  fatherMesh = smesh.Mesh(submesh.GetMesh()) #Mesh object
-  fatherMeshCells = fatherMesh.GetElementsByType(SMESH.VOLUME)
-  #We need correspondance between mesh element in salome and in HDF5
-  d = {fatherMeshCells[i]: i+1 for i in range(len(fatherMeshCells))}
+  #cell owning each face from the face index
+  snapshot = session.getSnapshot()
+  faceNodes, owner, neighbour = session.getFaceElemCells(elementList)
+  if (owner == -1).any():
+    print("Some faces of the group are not faces of a volume, STOP")
+    out.close()
+    return
+  cellIds = owner + 1
+  
+  #face barycenter (as Salome BaryCenter) and area
+  mask = faceNodes != -1
+  center = (snapshot.vertices[faceNodes] * mask[:,:,np.newaxis]).sum(axis=1)
+  center /= mask.sum(axis=1)[:,np.newaxis]
+  area = common.computeFacesGeometry(snapshot.vertices, faceNodes)[0]
   
-  for faceId in elementList:
-    nodes = fatherMesh.GetElemNodes(faceId)
-    element = fatherMesh.GetElementsByNodes(nodes, SMESH.VOLUME)[0]
-    out.write("{} ".format(d[element]))
-    center = fatherMesh.BaryCenter(faceId)
-    area = fatherMesh.GetArea(faceId)
-    for x in center:
-      out.write("{} ".format(x))
-    out.write("{}\n".format(area))
+  for cellId, xyz, a in zip(cellIds.tolist(), center.tolist(), area.tolist()):
+    out.write("{} {} {} {} {}\n".format(cellId, *xyz, a))
   
   out.close()
   return
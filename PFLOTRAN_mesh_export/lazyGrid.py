@@ -0,0 +1,361 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307 USA
+#
+# Author : Moise Rousseau (2021), email at moise.rousseau@polymtl.ca
+
+"""
+Lazy access to PFLOTRAN grid files (implicit and explicit, ASCII and HDF5)
+without loading them in memory, for example:
+
+  with PFLOTRANGrid("mesh.h5") as grid:
+    print(grid.getCellNumber(), grid.getRegionNames())
+    ids = grid.getRegion("rock")[:1000]
+
+HDF5 datasets are returned as h5py datasets (read when sliced), ASCII
+sections as LazyASCIIArray which parse only the requested rows of the
+memory mapped file.
+"""
+
+import os
+import mmap
+import numpy as np
+try:
+  import h5py
+except:
+  pass
+
+#PFLOTRAN implicit element type to number of nodes
+IMPLICIT_TYPES = {'T':4, 'P':5, 'W':6, 'H':8}
+IMPLICIT_FACE_TYPES = {'T':3, 'Q':4}
+
+
+
+class LineIndex:
+  """
+  Sparse index of the line starts of a memory mapped text file: one offset
+  every stride lines, the file is scanned by blocks
+  """
+  def __init__(self, mm, stride=1024, blockSize=2**26):
+    self.mm = mm
+    self.stride = stride
+    starts = [np.zeros(1, dtype='i8')]
+    n_lines = 0 #newlines found so far
+    for base in range(0, len(mm), blockSize):
+      block = np.frombuffer(mm[base:base+blockSize], dtype='u1')
+      newlines = np.flatnonzero(block == 10) + base
+      #line k+1 starts after the k-th newline (k from 0)
+      lineNumbers = np.arange(n_lines+1, n_lines+1+len(newlines))
+      keep = lineNumbers % stride == 0
+      starts.append(newlines[keep] + 1)
+      n_lines += len(newlines)
+    self.starts = np.concatenate(starts)
+    #last line without newline
+    self.n_lines = n_lines + int(len(mm) > 0 and mm[-1:] != b'\n')
+    return
+
+  def getLineStart(self, line):
+    if line >= self.n_lines:
+      return len(self.mm)
+    pos = int(self.starts[line // self.stride])
+    for i in range(line % self.stride):
+      pos = self.mm.find(b'\n', pos) + 1
+    return pos
+
+  def getLines(self, start, end):
+    """
+    Return the bytes of lines start to end (excluded)
+    """
+    return self.mm[self.getLineStart(start):self.getLineStart(end)]
+
+
+
+class LazyASCIIArray:
+  """
+  Rows first to first+n_rows of an ASCII file section, parsed on slicing
+  """
+  def __init__(self, index, first, n_rows, parser):
+    self.index = index
+    self.first = first
+    self.n_rows = n_rows
+    self.parser = parser
+    return
+
+  def __len__(self):
+    return self.n_rows
+
+  def __getitem__(self, item):
+    if isinstance(item, tuple):
+      rows, columns = item[0], item[1:]
+    else:
+      rows, columns = item, ()
+    if isinstance(rows, slice) and rows.step in [None, 1]:
+      start, end, step = rows.indices(self.n_rows)
+      data = self.parser(self.index.getLines(self.first+start, self.first+max(start,end)))
+    else:
+      rows = np.arange(self.n_rows)[rows]
+      if np.ndim(rows) == 0:
+        data = self.parser(self.index.getLines(self.first+rows, self.first+rows+1))[0]
+      else:
+        data = np.array([self.parser(self.index.getLines(self.first+x, self.first+x+1))[0]
+                         for x in rows])
+    return data[(Ellipsis,) + columns] if columns else data
+
+
+
+def parseImplicitCells(text, types=IMPLICIT_TYPES):
+  """
+  Parse implicit ASCII cell lines to rows [number of nodes, nodes]
+  padded with 0
+  """
+  text = text.decode()
+  lines = text.split('\n')
+  lines = [x for x in lines if x.strip()]
+  counts = np.array([types[x.lstrip()[0]] for x in lines], dtype='i8')
+  for letter in types:
+    text = text.replace(letter, ' ')
+  values = np.fromstring(text, dtype='i8', sep=' ')
+  maxNodes = max(types.values())
+  cells = np.zeros((len(counts), maxNodes+1), dtype='i8')
+  cells[:,0] = counts
+  mask = np.arange(maxNodes) < counts[:,np.newaxis]
+  cells[:,1:][mask] = values
+  return cells
+
+
+
+def parseImplicitFaces(text):
+  """
+  Parse surface region lines to rows [number of nodes, nodes] padded with 0,
+  as the Vertex Ids of HDF5 regions
+  """
+  return parseImplicitCells(text, IMPLICIT_FACE_TYPES)
+
+
+
+def parseIntRows(text):
+  return np.fromstring(text.decode(), dtype='i8', sep=' ')
+
+
+
+def parseFloatRows(n_columns):
+  def parser(text):
+    return np.fromstring(text.decode(), dtype='f8', sep=' ').reshape(-1, n_columns)
+  return parser
+
+
+
+class PFLOTRANGrid:
+  """
+  Lazy reader of a PFLOTRAN grid file. Datasets and regions are only read
+  when sliced. Regions written in separate files (.vs, and .ss for implicit
+  ASCII grids) are the regionFiles paths, or the files of the grid folder
+  consistent with the grid if not given
+  """
+  def __init__(self, f_in, regionFiles=None):
+    self.f_in = f_in
+    self.regionFiles = regionFiles
+    self.fileRegions = None #region name to file path
+    self.regionMaps = {} #region file path to [file, memory map, line index]
+    self.h5 = None
+    self.mm = None
+    self.index = None
+    self.explicit = False
+    if h5py.is_hdf5(f_in):
+      self.h5 = h5py.File(f_in, 'r')
+      self.explicit = "Connections" in self.h5["Domain"]
+    else:
+      self.src = open(f_in, 'rb')
+      self.mm = mmap.mmap(self.src.fileno(), 0, access=mmap.ACCESS_READ)
+      header = self.mm[:self.mm.find(b'\n')].decode().split()
+      self.explicit = header[0].upper() == "CELLS"
+      self.header = header
+    return
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *args):
+    self.close()
+    return
+
+  def close(self):
+    if self.h5 is not None:
+      self.h5.close()
+    if self.mm is not None:
+      self.mm.close()
+      self.src.close()
+    for src, mm, index in self.regionMaps.values():
+      if src is not None:
+        mm.close()
+        src.close()
+    self.regionMaps = {}
+    return
+
+  def getLineIndex(self):
+    if self.index is None:
+      self.index = LineIndex(self.mm)
+    return self.index
+
+  #domain
+  def getCellNumber(self):
+    if self.h5 is not None:
+      if self.explicit: return len(self.h5["Domain/Cells/Volumes"])
+      return len(self.h5["Domain/Cells"])
+    return int(self.header[1] if self.explicit else self.header[0])
+
+  def getVertexNumber(self):
+    if self.h5 is not None:
+      return len(self.h5["Domain/Vertices"]) if "Vertices" in self.h5["Domain"] else 0
+    return 0 if self.explicit else int(self.header[1])
+
+  def getCells(self):
+    """
+    Implicit grid: rows [number of nodes, node ids] (Domain/Cells)
+    Explicit grid: rows [id, x, y, z, volume] in ASCII, Domain/Cells group
+    in HDF5
+    """
+    if self.h5 is not None:
+      return self.h5["Domain/Cells"]
+    if self.explicit:
+      return LazyASCIIArray(self.getLineIndex(), 1, self.getCellNumber(), parseFloatRows(5))
+    return LazyASCIIArray(self.getLineIndex(), 1, self.getCellNumber(), parseImplicitCells)
+
+  def getVertices(self):
+    if self.h5 is not None:
+      return self.h5["Domain/Vertices"]
+    if self.explicit:
+      raise RuntimeError("Explicit ASCII grid does not store vertices")
+    return LazyASCIIArray(self.getLineIndex(), 1+self.getCellNumber(),
+                          self.getVertexNumber(), parseFloatRows(3))
+
+  #connections (explicit grid)
+  def getConnectionNumber(self):
+    if not self.explicit: return 0
+    if self.h5 is not None:
+      return len(self.h5["Domain/Connections/Areas"])
+    line = self.getLineIndex().getLines(self.getCellNumber()+1, self.getCellNumber()+2)
+    return int(line.split()[1])
+
+  def getConnections(self, name):
+    """
+    Explicit grid connection data: "Cell Ids", "Centers" or "Areas"
+    """
+    if self.h5 is not None:
+      return self.h5["Domain/Connections/" + name]
+    columns = {"Cell Ids":slice(0,2), "Centers":slice(2,5), "Areas":5}[name]
+    connections = LazyASCIIArray(self.getLineIndex(), self.getCellNumber()+2,
+                                 self.getConnectionNumber(), parseFloatRows(6))
+    return LazyColumns(connections, columns, int if name == "Cell Ids" else float)
+
+  #regions
+  def getRegionFileIndex(self, path):
+    """
+    Line index of the memory mapped region file path
+    """
+    if path not in self.regionMaps:
+      if os.path.getsize(path):
+        src = open(path, 'rb')
+        mm = mmap.mmap(src.fileno(), 0, access=mmap.ACCESS_READ)
+        self.regionMaps[path] = [src, mm, LineIndex(mm)]
+      else: #empty file cannot be memory mapped
+        self.regionMaps[path] = [None, b'', LineIndex(b'')]
+    return self.regionMaps[path][2]
+
+  def isGridRegionFile(self, path):
+    """
+    Region file consistent with the grid: cell ids region (.vs) with less
+    lines than cells, or surface region (.ss) of an implicit ASCII grid with
+    the number of faces given in its first line, the ids of their first and
+    last rows being in the grid
+    """
+    index = self.getRegionFileIndex(path)
+    try:
+      if path.endswith(".vs"):
+        if index.n_lines > self.getCellNumber(): return False
+        region, n_ids = LazyASCIIArray(index, 0, index.n_lines, parseIntRows), self.getCellNumber()
+      else:
+        if int(index.getLines(0,1)) != index.n_lines-1: return False
+        region, n_ids = LazyASCIIArray(index, 1, index.n_lines-1, parseImplicitFaces), self.getVertexNumber()
+      if len(region):
+        return np.max([region[0], region[-1]]) <= n_ids
+    except (ValueError, KeyError):
+      return False
+    return True
+
+  def getFileRegions(self):
+    """
+    Region name to region file path. Implicit HDF5 grids store their
+    regions in the grid file and surface regions are .ss files only for
+    implicit ASCII grids
+    """
+    if self.fileRegions is not None:
+      return self.fileRegions
+    extensions = [".vs"] if self.explicit or self.h5 is not None else [".vs", ".ss"]
+    if self.regionFiles is not None:
+      paths = [x for x in self.regionFiles if os.path.splitext(x)[1] in extensions]
+    elif self.h5 is not None and not self.explicit:
+      paths = []
+    else:
+      folder = os.path.dirname(os.path.abspath(self.f_in))
+      paths = [os.path.join(folder, x) for x in sorted(os.listdir(folder))
+               if os.path.splitext(x)[1] in extensions]
+      paths = [x for x in paths if self.isGridRegionFile(x)]
+    self.fileRegions = {os.path.splitext(os.path.basename(x))[0]:x for x in paths}
+    return self.fileRegions
+
+  def getRegionNames(self):
+    names = []
+    if self.h5 is not None and "Regions" in self.h5:
+      names = list(self.h5["Regions"].keys())
+    return names + [x for x in self.getFileRegions() if x not in names]
+
+  def getRegion(self, name):
+    """
+    Cell Ids (volume region) or Vertex Ids (surface region, rows [number of
+    nodes, nodes]) of a region
+    """
+    if self.h5 is not None and "Regions" in self.h5 and name in self.h5["Regions"]:
+      region = self.h5["Regions/" + name]
+      return region["Cell Ids" if "Cell Ids" in region else "Vertex Ids"]
+    if name not in self.getFileRegions():
+      raise RuntimeError(f"Region {name} not found")
+    path = self.getFileRegions()[name]
+    index = self.getRegionFileIndex(path)
+    if path.endswith(".vs"):
+      return LazyASCIIArray(index, 0, index.n_lines, parseIntRows)
+    return LazyASCIIArray(index, 1, index.n_lines-1, parseImplicitFaces)
+
+  def getRegionSize(self, name):
+    return len(self.getRegion(name))
+
+
+
+class LazyColumns:
+  """
+  Some columns of a LazyASCIIArray, converted to dtype on slicing
+  """
+  def __init__(self, array, columns, dtype):
+    self.array = array
+    self.columns = columns
+    self.dtype = dtype
+    return
+
+  def __len__(self):
+    return len(self.array)
+
+  def __getitem__(self, item):
+    return self.array[item][...,self.columns].astype(self.dtype)
@@ -19,16 +19,36 @@
 
 
 
-import SMESH
+import os
+import tempfile
 import numpy as np
-import salome
+import meshSnapshot
 try:
   import h5py
 except:
   pass
 
 
+#PFLOTRAN implicit element type to number of nodes
+IMPLICIT_TYPES = {'T':4, 'P':5, 'W':6, 'H':8}
+#snapshot cell type to MED cell type
+MED_CELL_TYPES = {
+  meshSnapshot.TETRA : 14,
+  meshSnapshot.PYRAMID : 15,
+  meshSnapshot.PENTA : 16,
+  meshSnapshot.HEXA : 18,
+  meshSnapshot.POLYHEDRA : 31,
+}
+#XDMF cell type to snapshot cell type
+XDMF_CELL_TYPES = {6:meshSnapshot.TETRA, 7:meshSnapshot.PYRAMID, 
+                   8:meshSnapshot.PENTA, 9:meshSnapshot.HEXA}
+
+
 def ReadPFLOTRANMesh(f_in):
+  """
+  Import a PFLOTRAN grid (.ugi, .uge or .h5) as a new Salome mesh
+  Explicit grids are rebuilt from their _Domain.h5 file
+  """
   #determine format
   extension = f_in.split('.')[-1]
   if extension not in ["h5", "uge", "ugi"]:
@@ -37,99 +57,251 @@ def ReadPFLOTRANMesh(f_in):
     try:
       f = h5py.File(f_in, 'r')
       grp = f["Domain"]
+      f.close()
       extension = 'h5'
     except:
       try:
         f = open(f_in, 'r')
         test = f.readline().split()[0].lower()
+        f.close()
         if test == "cells": extension = 'uge'
         else: extension = 'ugi'
       except:
-        f.close()
         print("Impossible to determine the format")
         return 1
-  f.close()
-  #create new mesh
-  mesh_name = f_in.split('/')[-1]
-  mesh_name = '.'.join(f_in.split('.')[:-1])
-  mesh = smesh.Mesh(name=mesh_name)
+  mesh_name = '.'.join(f_in.split('/')[-1].split('.')[:-1])
+  groups = {}
   if extension == 'h5':
     f = h5py.File(f_in, 'r')
-    grp = f["Domain"]
-    if "Connections" in list(grp.keys()): 
-      f.close()
-      readPFLOTRANMeshExplicitHDF5(f_in,mesh)
-    elif "Cells" in list(grp.keys()):
-      f.close()
-      readPFLOTRANMeshImplicitHDF5(f_in,mesh)
+    explicit = "Connections" in f["Domain"]
+    f.close()
+    if explicit:
+      grid = readPFLOTRANMeshExplicitHDF5(f_in)
+    else:
+      grid = readPFLOTRANMeshImplicitHDF5(f_in)
+      groups = readPFLOTRANRegionsHDF5(f_in)
   elif extension == 'ugi':
-    readPFLOTRANMeshImplicitASCII(f_in,mesh)
+    grid = readPFLOTRANMeshImplicitASCII(f_in)
   elif extension == 'uge':
-    readPFLOTRANMeshExplicitASCII(f_in,mesh)
+    grid = readPFLOTRANMeshExplicitASCII(f_in)
   else:
     return 1
+  if grid is None:
+    return 1
+  createSalomeMesh(mesh_name, *grid, groups=groups)
   return 0
   
 
 
-def readPFLOTRANMeshImplictASCII(f_in, mesh):
-  #add vertices first
+def readPFLOTRANMeshImplicitASCII(f_in):
+  """
+  Read an implicit ASCII grid in one pass
+  Return vertices, cell types and CSR connectivity (0-based, Salome order)
+  """
   src = open(f_in, 'r')
   n_elements, n_vertices = [int(x) for x in src.readline().split()]
-  for i in range(n_elements): src.readline() #pass elements
-  #add vertices
-  for i in range(n_vertices):
-    X, Y, Z = [float(x) for x in src.readline().split()]
-    mesh.AddNode(X,Y,Z)
-  #close and reopen to go at first line
-  src.close() 
-  src = open(f_in, 'r')
-  src.readline()
-  #add elements
-  for i in range(n_elements):
-    line = src.readline().split()
-    elem_type = line[0]
-    nodes = [int(x) for x in line[1:]]
-    nodes = PFLOTRANToSalomeIndexes(nodes)
-    if not nodes:
-      print(f"Element type not recognized {elem_type}")
-      return 1
-    mesh.AddVolume(nodes)
-  return 0
+  lines = src.read().split('\n')
+  src.close()
+  elements = lines[:n_elements]
+  #number of nodes given by the element type letter
+  try:
+    cellTypes = np.array([IMPLICIT_TYPES[x.lstrip()[0]] for x in elements], dtype='i8')
+  except KeyError as e:
+    print(f"Element type not recognized {e}")
+    return None
+  text = ' '.join(elements)
+  for letter in IMPLICIT_TYPES:
+    text = text.replace(letter, ' ')
+  conn = np.fromstring(text, dtype='i8', sep=' ') - 1
+  vertices = np.fromstring(' '.join(lines[n_elements:n_elements+n_vertices]), 
+                           dtype='f8', sep=' ').reshape(-1,3)
+  offsets = np.zeros(n_elements+1, dtype='i8')
+  np.cumsum(cellTypes, out=offsets[1:])
+  reorderConnectivity(cellTypes, offsets, conn, meshSnapshot.SALOME_NODE_ORDER)
+  return vertices, cellTypes, offsets, conn
   
 
 
-def readPFLOTRANMeshImplictHDF5(f_in, mesh):
-  print("Not Implemented")
-  return 1
+def readPFLOTRANMeshImplicitHDF5(f_in):
+  """
+  Read an implicit HDF5 grid
+  Return vertices, cell types and CSR connectivity (0-based, Salome order)
+  """
+  f = h5py.File(f_in, 'r')
+  cells = f["Domain/Cells"][...].astype('i8')
+  vertices = f["Domain/Vertices"][...]
+  f.close()
+  cellTypes = cells[:,0]
+  if not np.isin(cellTypes, list(IMPLICIT_TYPES.values())).all():
+    print("Element type not recognized")
+    return None
+  mask = np.arange(cells.shape[1]-1) < cellTypes[:,np.newaxis]
+  conn = cells[:,1:][mask] - 1
+  offsets = np.zeros(len(cells)+1, dtype='i8')
+  np.cumsum(cellTypes, out=offsets[1:])
+  reorderConnectivity(cellTypes, offsets, conn, meshSnapshot.SALOME_NODE_ORDER)
+  return vertices, cellTypes, offsets, conn
+
 
 
+def readPFLOTRANRegionsHDF5(f_in):
+  """
+  Read the cell regions of a HDF5 grid, return a dict name: 0-based cell ids
+  """
+  groups = {}
+  f = h5py.File(f_in, 'r')
+  if "Regions" in f:
+    for name, region in f["Regions"].items():
+      if "Cell Ids" in region:
+        groups[name] = region["Cell Ids"][...].astype('i8') - 1
+  f.close()
+  return groups
 
-def readPFLOTRANMeshExplicitASCII(f_in, mesh):
-  # TODO (moise) 
-  # read if there is a vertices / elements section
-  # if not, can not import
-  print("Not Implemented")
-  return 1
 
 
+def readPFLOTRANMeshExplicitASCII(f_in):
+  """
+  Explicit grids do not store the cell connectivity, the mesh is rebuilt 
+  from the domain file written along the grid
+  """
+  return readPFLOTRANDomainFile('.'.join(f_in.split('.')[:-1]) + "_Domain.h5")
 
-def readPFLOTRANMeshExplicitHDF5(f_in, mesh):
-  print("Not Implemented")
-  return 1
+
+
+def readPFLOTRANMeshExplicitHDF5(f_in):
+  return readPFLOTRANMeshExplicitASCII(f_in)
+
+
+
+def readPFLOTRANDomainFile(domain_file):
+  """
+  Read the XDMF mixed topology of a _Domain.h5 file
+  Return vertices, cell types and CSR connectivity (0-based, Salome order),
+  polyhedra connectivity being their face node lists separated by -1
+  """
+  if not os.path.isfile(domain_file):
+    print(f"Explicit grid does not store cell connectivity and domain file {domain_file} not found")
+    return None
+  f = h5py.File(domain_file, 'r')
+  vertices = f["Domain/Vertices"][...]
+  stream = f["Domain/Cells"][...].astype('i8')
+  n_elements = int(f["Domain/Cells"].attrs["Cell number"][0])
+  f.close()
+  #walk the stream once to find the cells and the polyhedra face sizes
+  starts = np.zeros(n_elements+1, dtype='i8')
+  firstFaces, otherFaces = [], []
+  pos = 0
+  for i in range(n_elements):
+    starts[i] = pos
+    if stream[pos] == 16: #polyhedron
+      pos += 2
+      for j in range(stream[pos-1]):
+        (otherFaces if j else firstFaces).append(pos)
+        pos += stream[pos] + 1
+    else:
+      pos += XDMF_CELL_TYPES[stream[pos]] + 1
+  starts[-1] = pos
+  xdmfTypes = stream[starts[:-1]]
+  cellTypes = np.zeros(n_elements, dtype='i8') #polyhedra
+  for xdmfType, cellType in XDMF_CELL_TYPES.items():
+    cellTypes[xdmfTypes == xdmfType] = cellType
+  #remove cell types, number of faces and first face sizes, other face
+  #sizes become separators
+  poly = cellTypes == meshSnapshot.POLYHEDRA
+  keep = np.ones(len(stream), dtype=bool)
+  keep[starts[:-1]] = False
+  keep[starts[:-1][poly]+1] = False
+  keep[np.array(firstFaces, dtype='i8')] = False
+  stream[np.array(otherFaces, dtype='i8')] = -1
+  sizes = np.diff(starts) - 1
+  sizes[poly] -= 2
+  offsets = np.zeros(n_elements+1, dtype='i8')
+  np.cumsum(sizes, out=offsets[1:])
+  conn = stream[keep]
+  reorderConnectivity(cellTypes, offsets, conn, meshSnapshot.VTK_NODE_ORDER)
+  return vertices, cellTypes, offsets, conn
 
 
 
 def PFLOTRANToSalomeIndexes(nodes):
-  if len(nodes) == 8:
-    nodes = [nodes[0],nodes[3],nodes[2],nodes[1],nodes[4],nodes[7],nodes[6],nodes[5]]
-  elif len(nodes) == 6:
-    nodes = [nodes[1],nodes[0],nodes[2],nodes[4],nodes[3],nodes[5]]
-  elif len(nodes) == 5:
-    nodes = [nodes[0],nodes[3],nodes[2],nodes[1],nodes[4]]
-  elif len(nodes) == 4:
-    nodes = [nodes[1],nodes[0],nodes[2],nodes[3]]
-  else: 
-    nodes = []
-  return nodes
+  """
+  Convert element node list from PFLOTRAN to Salome order (inverse of 
+  exportMesh.salomeToPFLOTRANNodeOrder). nodes could also be a 
+  (n_elements, n_nodes) array of elements of the same type
+  """
+  nodes = np.asarray(nodes)
+  order = meshSnapshot.SALOME_NODE_ORDER.get(nodes.shape[-1])
+  if order is None: return []
+  return nodes[...,order]
+
+
+
+def reorderConnectivity(cellTypes, offsets, conn, orders):
+  """
+  Permute in place the nodes of the linear cells of a CSR connectivity
+  """
+  for cellType, order in orders.items():
+    cells = np.nonzero(cellTypes == cellType)[0]
+    if not len(cells): continue
+    index = offsets[cells][:,np.newaxis] + np.arange(cellType)
+    conn[index] = conn[index[:,order]]
+  return
+
+
+
+def createSalomeMesh(name, vertices, cellTypes, offsets, conn, groups=None):
+  """
+  Create a Salome mesh in bulk by writing a MED file with MEDCoupling and
+  importing it. groups is a dict name: 0-based cell ids
+  """
+  import salome
+  from salome.smesh import smeshBuilder
+  try:
+    import medcoupling as mc
+  except ImportError: #older Salome
+    import MEDLoader as mc
+  idType = 'i8' if getattr(mc, "MEDCouplingSizeOfIDs", lambda: 32)() == 64 else 'i4'
+  def toDataArrayInt(array):
+    return mc.DataArrayInt(np.ascontiguousarray(array, dtype=idType))
+  
+  n_elements = len(cellTypes)
+  #MED connectivity: cell type followed by its nodes
+  medConn = np.empty(len(conn)+n_elements, dtype='i8')
+  typePos = offsets[:-1] + np.arange(n_elements)
+  medTypes = np.zeros(max(MED_CELL_TYPES)+1, dtype='i8')
+  for cellType, medType in MED_CELL_TYPES.items():
+    medTypes[cellType] = medType
+  medConn[typePos] = medTypes[cellTypes]
+  isNode = np.ones(len(medConn), dtype=bool)
+  isNode[typePos] = False
+  medConn[isNode] = conn
+  umesh = mc.MEDCouplingUMesh(name, 3)
+  umesh.setCoords(mc.DataArrayDouble(np.ascontiguousarray(vertices, dtype='f8')))
+  umesh.setConnectivity(toDataArrayInt(medConn), 
+                        toDataArrayInt(offsets + np.arange(n_elements+1)), True)
+  #MED files store cells sorted by type
+  old2new = umesh.sortCellsInMEDFileFrmt()
+  old2new = old2new.toNumPyArray() if old2new is not None else np.arange(n_elements)
+  medMesh = mc.MEDFileUMesh()
+  medMesh.setMeshAtLevel(0, umesh)
+  medGroups = []
+  for groupName, ids in (groups or {}).items():
+    group = toDataArrayInt(np.sort(old2new[ids]))
+    group.setName(groupName)
+    medGroups.append(group)
+  if medGroups:
+    medMesh.setGroupsAtLevel(0, medGroups)
   
+  fd, medFile = tempfile.mkstemp(suffix=".med")
+  os.close(fd)
+  try:
+    medMesh.write(medFile, 2)
+    smesh = smeshBuilder.New()
+    meshes, status = smesh.CreateMeshesFromMED(medFile)
+  finally:
+    os.remove(medFile)
+  mesh = meshes[0]
+  mesh.SetName(name)
+  if salome.sg.hasDesktop():
+    salome.sg.updateObjBrowser()
+  return mesh
@@ -112,6 +112,100 @@ def computeCenterFromNodeList(nodesId,mesh):
   return center
   
 
+def computeFacesGeometry(vertices, faceNodes, chunkSize=100000):
+  """
+  Compute area, center and unit normal of many faces at once.
+  faceNodes is a (n_faces, max_face_size) array of vertex rows padded with -1
+  (see meshTopology.csrToPadded for CSR connectivity).
+  Normal and area are given by the Newell method, center is weighted by the
+  edge length as in computeCenterFromNodeList.
+  """
+  n_faces, width = faceNodes.shape
+  areas = np.zeros(n_faces, dtype='f8')
+  centers = np.zeros((n_faces,3), dtype='f8')
+  normals = np.zeros((n_faces,3), dtype='f8')
+  columns = np.arange(width)
+  for start in range(0, n_faces, chunkSize):
+    nodes = faceNodes[start:start+chunkSize]
+    mask = nodes >= 0
+    sizes = mask.sum(axis=1)
+    #next node of each edge, padding refer to the first node (null edge)
+    nextColumn = np.where(mask, (columns+1) % sizes[:,np.newaxis], 0)
+    nodes = np.where(mask, nodes, nodes[:,:1])
+    points = vertices[nodes]
+    nextPoints = np.take_along_axis(points, nextColumn[:,:,np.newaxis], axis=1)
+    #Newell normal relative to the first node to limit round-off
+    origin = points[:,0,np.newaxis,:]
+    n = np.cross(points - origin, nextPoints - origin).sum(axis=1)
+    norm = np.sqrt(np.einsum('ij,ij->i', n, n))
+    areas[start:start+chunkSize] = norm / 2
+    norm[norm == 0.] = 1.
+    normals[start:start+chunkSize] = n / norm[:,np.newaxis]
+    #center
+    L = np.linalg.norm(nextPoints - points, axis=2)
+    c = ((points + nextPoints) / 2 * L[:,:,np.newaxis]).sum(axis=1)
+    centers[start:start+chunkSize] = c / L.sum(axis=1)[:,np.newaxis]
+  return areas, centers, normals
+
+
+def computeFacesGeometryParallel(vertices, faceNodes, n_workers=1, chunkSize=100000):
+  """
+  Same as computeFacesGeometry, the faces being split in n_workers contiguous
+  partitions processed in separate processes. Each face is computed exactly
+  as in the serial function and partitions are concatenated in order, so the
+  output is identical to the serial one.
+  """
+  n_faces = len(faceNodes)
+  if n_workers <= 1 or n_faces < 2*chunkSize:
+    return computeFacesGeometry(vertices, faceNodes, chunkSize)
+  from concurrent.futures import ProcessPoolExecutor
+  bounds = np.linspace(0, n_faces, n_workers+1).astype('i8')
+  parts = [faceNodes[bounds[i]:bounds[i+1]] for i in range(n_workers)]
+  with ProcessPoolExecutor(max_workers=n_workers) as executor:
+    results = list(executor.map(computeFacesGeometry, [vertices]*n_workers, 
+                                parts, [chunkSize]*n_workers))
+  areas = np.concatenate([x[0] for x in results])
+  centers = np.concatenate([x[1] for x in results])
+  normals = np.concatenate([x[2] for x in results])
+  return areas, centers, normals
+
+
+def computeCellsVolumeAndCenter(vertices, faceNodes, faceCells, n_cells, 
+                                reference=None, chunkSize=100000):
+  """
+  Compute volume and centroid of many polyhedral cells at once using the
+  divergence theorem: each face is split in triangles forming a tetrahedron
+  with a reference point of its cell (cell barycenter for example).
+  faceNodes is a (n_faces, max_face_size) array of vertex rows padded with -1,
+  faceCells the cell index of each face. Faces of a given cell must be
+  consistently oriented. Return the signed volumes (negative for cells with
+  inward faces) and the centroids.
+  """
+  if reference is None: reference = np.zeros((n_cells,3), dtype='f8')
+  volumes = np.zeros(n_cells, dtype='f8')
+  moments = np.zeros((n_cells,3), dtype='f8')
+  n_faces, width = faceNodes.shape
+  for start in range(0, n_faces, chunkSize):
+    nodes = faceNodes[start:start+chunkSize]
+    cells = faceCells[start:start+chunkSize]
+    sizes = (nodes >= 0).sum(axis=1)
+    ref = reference[cells][:,np.newaxis,:]
+    points = vertices[np.where(nodes >= 0, nodes, nodes[:,:1])] - ref
+    #triangle fan (0, j, j+1) of each face
+    a = points[:,:1,:]
+    b = points[:,1:-1,:]
+    c = points[:,2:,:]
+    valid = np.arange(2, width) < sizes[:,np.newaxis]
+    v = np.einsum('ijk,ijk->ij', np.broadcast_to(a, b.shape), np.cross(b, c)) / 6
+    v *= valid
+    m = v[:,:,np.newaxis] * (a + b + c) / 4 #relative to the reference point
+    np.add.at(volumes, cells, v.sum(axis=1))
+    np.add.at(moments, cells, m.sum(axis=1))
+  with np.errstate(invalid='ignore', divide='ignore'):
+    centers = reference + moments / volumes[:,np.newaxis]
+  return volumes, centers
+
+
 def computeCellCenterVectorFromCellIds(cellIds, mesh):
   X1,Y1,Z1 = mesh.BaryCenter(cellIds[0])
   X2,Y2,Z2 = mesh.BaryCenter(cellIds[1])
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307 USA
+#
+# Author : Moise Rousseau (2021), email at moise.rousseau@polymtl.ca
+
+import meshSnapshot
+import meshTopology
+
+
+
+class ExportSession:
+  """
+  Hold the mesh snapshot (and the data derived from it) shared by the mesh,
+  group and integral flux exporters during one export.
+  The snapshot is rebuilt if the mesh is modified between two calls.
+  """
+  def __init__(self, mesh, verbose=True):
+    self.mesh = mesh
+    self.verbose = verbose
+    self.snapshot = None
+    self.signature = None
+    self.faceIndex = None
+    return
+
+  def getMeshSignature(self):
+    signature = [self.mesh.NbNodes(), self.mesh.NbElements()]
+    if hasattr(self.mesh, "GetMTime"):
+      signature.append(self.mesh.GetMTime())
+    return tuple(signature)
+
+  def getSnapshot(self):
+    signature = self.getMeshSignature()
+    if self.snapshot is None or signature != self.signature:
+      self.snapshot = meshSnapshot.snapshotFromMesh(self.mesh, self.verbose)
+      self.signature = signature
+      self.faceIndex = None
+    return self.snapshot
+
+  def getPFLOTRANCellIds(self, salomeIds):
+    """
+    Translate a list of Salome volume ids to PFLOTRAN cell ids
+    """
+    return self.getSnapshot().cellIdsToPFLOTRAN(salomeIds)
+
+  def getFaceIndex(self):
+    """
+    Index of the cell faces to find the cells sharing a face
+    """
+    snapshot = self.getSnapshot()
+    if self.faceIndex is None:
+      faceNodes = meshTopology.csrToPadded(snapshot.faceNodesOffsets, snapshot.faceNodes)
+      self.faceIndex = meshTopology.FaceIndex(faceNodes, snapshot.getFaceCells())
+    return self.faceIndex
+
+  def getFaceElemCells(self, faceIds):
+    """
+    Return the vertex rows of the given Salome face elements with the
+    index of the two cells sharing each face (-1 if none)
+    """
+    snapshot = self.getSnapshot()
+    faceNodes = snapshot.getFaceElemNodes(faceIds)
+    owner, neighbour = self.getFaceIndex().lookup(faceNodes)
+    return faceNodes, owner, neighbour
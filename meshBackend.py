@@ -0,0 +1,272 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307 USA
+#
+# Author : Moise Rousseau (2021), email at moise.rousseau@polymtl.ca
+
+"""
+Salome free mesh backend: a NumPy mesh exposing the part of the SMESH mesh
+and group API used by the exporters, loaded from MED, VTK, Gmsh... files
+with meshio (https://github.com/nschloe/meshio)
+"""
+
+import os
+import numpy as np
+import meshSnapshot
+
+try:
+  import SMESH
+  NODE, EDGE, FACE, VOLUME, ELEM0D = SMESH.NODE, SMESH.EDGE, SMESH.FACE, SMESH.VOLUME, SMESH.ELEM0D
+except ImportError:
+  NODE, EDGE, FACE, VOLUME, ELEM0D = "NODE", "EDGE", "FACE", "VOLUME", "ELEM0D"
+
+
+#meshio cell type to element type and snapshot cell type
+MESHIO_TYPES = {
+  "vertex" : (ELEM0D, None),
+  "line" : (EDGE, None),
+  "triangle" : (FACE, None),
+  "quad" : (FACE, None),
+  "polygon" : (FACE, None),
+  "tetra" : (VOLUME, meshSnapshot.TETRA),
+  "pyramid" : (VOLUME, meshSnapshot.PYRAMID),
+  "wedge" : (VOLUME, meshSnapshot.PENTA),
+  "hexahedron" : (VOLUME, meshSnapshot.HEXA),
+}
+
+#topological dimension of element types
+ELEM_DIMENSION = {ELEM0D:0, EDGE:1, FACE:2, VOLUME:3}
+
+
+
+
+class ArrayGroup:
+  """
+  Group of elements of an ArrayMesh, with the SMESH group methods
+  """
+  def __init__(self, mesh, name, elemType, ids):
+    self.mesh = mesh
+    self.name = name
+    self.elemType = elemType
+    self.ids = np.asarray(ids, dtype='i8')
+    return
+
+  def GetName(self):
+    return self.name
+
+  def GetType(self):
+    return self.elemType
+
+  def GetTypes(self):
+    return [self.elemType]
+
+  def GetIDs(self):
+    return self.ids.tolist()
+
+  def Add(self, ids):
+    n = len(self.ids)
+    self.ids = np.union1d(self.ids, np.asarray(ids, dtype='i8'))
+    return len(self.ids) - n
+
+  def Size(self):
+    return len(self.ids)
+
+  def GetMesh(self):
+    return self.mesh
+
+
+
+class ArrayMesh:
+  """
+  Mesh stored in NumPy arrays with the SMESH mesh methods used by the
+  exporters. Nodes and elements are numbered from 1 in the order of the
+  arrays, element connectivities are stored in CSR format and refer to the
+  0-based node rows.
+  """
+  def __init__(self, name, vertices, elemTypes, cellTypes, elemNodesOffsets, elemNodes):
+    self.name = name
+    self.vertices = np.asarray(vertices, dtype='f8')
+    self.elemTypes = np.asarray(elemTypes, dtype=object)
+    self.cellTypes = np.asarray(cellTypes, dtype='i8') #-1 if not a volume
+    self.elemNodesOffsets = np.asarray(elemNodesOffsets, dtype='i8')
+    self.elemNodes = np.asarray(elemNodes, dtype='i8')
+    self.groups = []
+    return
+
+  def GetName(self):
+    return self.name
+
+  def GetMesh(self):
+    return self
+
+  def NbNodes(self):
+    return len(self.vertices)
+
+  def NbElements(self):
+    return len(self.elemTypes)
+
+  def NbVolumes(self):
+    return int((self.elemTypes == VOLUME).sum())
+
+  def GetNodesId(self):
+    return list(range(1, self.NbNodes()+1))
+
+  def GetElementsId(self):
+    return list(range(1, self.NbElements()+1))
+
+  def GetElementsByType(self, elemType):
+    return (np.nonzero(self.elemTypes == elemType)[0] + 1).tolist()
+
+  def GetTypes(self):
+    return [x for x in [EDGE, FACE, VOLUME, ELEM0D] if (self.elemTypes == x).any()]
+
+  def GetNodeXYZ(self, nodeId):
+    return self.vertices[nodeId-1].tolist()
+
+  def GetElemNodes(self, elemId):
+    start, end = self.elemNodesOffsets[elemId-1:elemId+1]
+    return (self.elemNodes[start:end] + 1).tolist()
+
+  def ElemNbFaces(self, elemId):
+    if self.cellTypes[elemId-1] not in meshSnapshot.CELL_FACES: return 0
+    return len(meshSnapshot.CELL_FACES[self.cellTypes[elemId-1]])
+
+  def GetElemFaceNodes(self, elemId, faceIndex):
+    nodes = self.GetElemNodes(elemId)
+    face = meshSnapshot.CELL_FACES[self.cellTypes[elemId-1]][faceIndex]
+    return [nodes[i] for i in face]
+
+  def BaryCenter(self, elemId):
+    start, end = self.elemNodesOffsets[elemId-1:elemId+1]
+    return self.vertices[self.elemNodes[start:end]].mean(axis=0).tolist()
+
+  def GetGroups(self):
+    return list(self.groups)
+
+  def GetGroupByName(self, name, elemType=None):
+    return [x for x in self.groups if x.GetName() == name and
+                                      (elemType is None or x.GetType() == elemType)]
+
+  def CreateGroup(self, elemType, name, ids=()):
+    group = ArrayGroup(self, name, elemType, ids)
+    self.groups.append(group)
+    return group
+
+  def getSnapshot(self):
+    """
+    Build the mesh snapshot directly from the arrays
+    """
+    snapshot = meshSnapshot.MeshSnapshot()
+    snapshot.nodeIds = np.arange(1, self.NbNodes()+1, dtype='i8')
+    snapshot.vertices = self.vertices
+    snapshot.buildLookup()
+    sizes = np.diff(self.elemNodesOffsets)
+
+    def extract(elems):
+      offsets = np.zeros(len(elems)+1, dtype='i8')
+      np.cumsum(sizes[elems], out=offsets[1:])
+      index = np.repeat(self.elemNodesOffsets[elems] - offsets[:-1], sizes[elems])
+      return offsets, self.elemNodes[index + np.arange(offsets[-1])]
+
+    volumes = np.nonzero(self.elemTypes == VOLUME)[0]
+    snapshot.cellIds = volumes + 1
+    snapshot.cellTypes = self.cellTypes[volumes]
+    snapshot.cellNodesOffsets, snapshot.cellNodes = extract(volumes)
+    faces = np.nonzero(self.elemTypes == FACE)[0]
+    snapshot.faceElemIds = faces + 1
+    snapshot.faceElemNodesOffsets, snapshot.faceElemNodes = extract(faces)
+    if len(faces):
+      snapshot.faceElemLookup = np.full(faces.max()+2, -1, dtype='i8')
+      snapshot.faceElemLookup[snapshot.faceElemIds] = np.arange(len(faces), dtype='i8')
+    snapshot.buildFaces()
+    elem0D = np.nonzero(self.elemTypes == ELEM0D)[0]
+    snapshot.elem0DIds = elem0D + 1
+    if len(elem0D):
+      snapshot.elem0DNodes = self.elemNodes[self.elemNodesOffsets[elem0D]]
+    return snapshot
+
+
+
+def readMesh(meshFile, name=None):
+  """
+  Read a mesh file with meshio and return an ArrayMesh.
+  Groups are created from the cell sets, the Gmsh physical groups or the
+  MED families
+  """
+  import meshio
+  src = meshio.read(meshFile)
+  if name is None:
+    name = os.path.splitext(os.path.basename(meshFile))[0]
+  return meshFromMeshio(src, name, salomeOrder=meshFile.lower().endswith(".med"))
+
+
+
+def meshFromMeshio(src, name="Mesh", salomeOrder=False):
+  """
+  Convert a meshio Mesh to an ArrayMesh. Volume connectivities are
+  converted from the VTK to the Salome node order unless salomeOrder
+  (MED files already follow the Salome order)
+  """
+  elemTypes, cellTypes, sizes, conns = [], [], [], []
+  blockStart = [0]
+  for block in src.cells:
+    if block.type not in MESHIO_TYPES:
+      raise RuntimeError("Element type {} not supported".format(block.type))
+    elemType, cellType = MESHIO_TYPES[block.type]
+    data = block.data
+    if cellType is not None and not salomeOrder:
+      data = np.asarray(data)[:,meshSnapshot.VTK_NODE_ORDER[cellType]]
+    if isinstance(data, list): #polygons of different sizes
+      sizes.append(np.array([len(x) for x in data], dtype='i8'))
+      conns.append(np.concatenate(data).astype('i8') if data else np.zeros(0, dtype='i8'))
+    else:
+      data = np.asarray(data, dtype='i8')
+      sizes.append(np.full(len(data), data.shape[1], dtype='i8'))
+      conns.append(data.ravel())
+    elemTypes.append(np.full(len(sizes[-1]), elemType, dtype=object))
+    cellTypes.append(np.full(len(sizes[-1]), -1 if cellType is None else cellType, dtype='i8'))
+    blockStart.append(blockStart[-1] + len(sizes[-1]))
+  offsets = np.zeros(blockStart[-1]+1, dtype='i8')
+  np.cumsum(np.concatenate(sizes), out=offsets[1:])
+  mesh = ArrayMesh(name, src.points[:,:3] if src.points.shape[1] >= 3 else
+                   np.pad(src.points, ((0,0),(0,3-src.points.shape[1]))),
+                   np.concatenate(elemTypes), np.concatenate(cellTypes),
+                   offsets, np.concatenate(conns))
+
+  #groups as lists of (block, local element indexes)
+  groups = {}
+  for groupName, blocks in src.cell_sets.items():
+    groups[groupName] = [(i, np.asarray(x)) for i,x in enumerate(blocks) if x is not None]
+  if not groups and "gmsh:physical" in src.cell_data:
+    #physical tags are unique only among groups of the same dimension
+    for groupName, (tag, dim) in src.field_data.items():
+      groups[groupName] = [(i, np.nonzero(x == tag)[0]) for i,x in
+                           enumerate(src.cell_data["gmsh:physical"])
+                           if ELEM_DIMENSION[MESHIO_TYPES[src.cells[i].type][0]] == dim]
+  if not groups and "cell_tags" in src.cell_data and hasattr(src, "cell_tags"):
+    for tag, names in src.cell_tags.items():
+      for groupName in names:
+        groups.setdefault(groupName, []).extend(
+          [(i, np.nonzero(x == tag)[0]) for i,x in enumerate(src.cell_data["cell_tags"])])
+  for groupName, blocks in groups.items():
+    ids = np.concatenate([blockStart[i] + x for i,x in blocks] + [np.zeros(0, dtype='i8')]) + 1
+    if not len(ids): continue
+    ids = np.unique(ids)
+    #one group per element type
+    for elemType in [VOLUME, FACE]:
+      typeIds = ids[mesh.elemTypes[ids-1] == elemType]
+      if len(typeIds): mesh.CreateGroup(elemType, groupName, typeIds)
+  return mesh
@@ -0,0 +1,344 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307 USA
+#
+# Author : Moise Rousseau (2021), email at moise.rousseau@polymtl.ca
+
+import os
+import tempfile
+import numpy as np
+
+
+#cell type codes, independent of the SMESH enumeration
+#(linear types are coded by their number of nodes)
+TETRA = 4
+PYRAMID = 5
+PENTA = 6
+HEXA = 8
+POLYHEDRA = 0
+
+#faces of the linear volume elements in Salome node order
+#all faces of a given element are consistently oriented
+CELL_FACES = {
+  TETRA : [[0,1,2], [0,3,1], [1,3,2], [0,2,3]],
+  PYRAMID : [[0,1,2,3], [0,4,1], [1,4,2], [2,4,3], [3,4,0]],
+  PENTA : [[0,1,2], [3,5,4], [0,3,4,1], [1,4,5,2], [0,2,5,3]],
+  HEXA : [[0,1,2,3], [4,7,6,5], [0,4,5,1], [1,5,6,2], [2,6,7,3], [3,7,4,0]],
+}
+
+
+#Salome to PFLOTRAN node permutation of the linear volume elements
+#(PFLOTRAN nodes = Salome nodes[order]) and its inverse
+PFLOTRAN_NODE_ORDER = {
+  TETRA : [1,0,2,3],
+  PYRAMID : [0,3,2,1,4],
+  PENTA : [1,0,2,4,3,5],
+  HEXA : [0,3,2,1,4,7,6,5],
+}
+SALOME_NODE_ORDER = {x : np.argsort(y).tolist() for x,y in PFLOTRAN_NODE_ORDER.items()}
+
+#Salome to VTK / XDMF node permutation of the linear volume elements
+#(its own inverse)
+VTK_NODE_ORDER = {
+  TETRA : [0,2,1,3],
+  PYRAMID : [0,3,2,1,4],
+  PENTA : [0,2,1,3,5,4],
+  HEXA : [0,3,2,1,4,7,6,5],
+}
+
+
+
+class MeshSnapshot:
+  """
+  Contiguous array copy of a Salome mesh used by the exporters instead of the
+  live mesh object.
+  Connectivities are stored in CSR format (offsets + values) and refer to the
+  vertices by their 0-based row in the vertices array.
+  """
+  def __init__(self):
+    self.nodeIds = None #Salome node ids, vertices are stored in this order
+    self.vertices = None #(n_nodes,3)
+    self.cellIds = None #Salome volume ids, in PFLOTRAN cell order
+    self.cellTypes = None
+    self.cellNodesOffsets = None
+    self.cellNodes = None
+    self.cellFacesOffsets = None #index of the first face of each cell
+    self.faceNodesOffsets = None
+    self.faceNodes = None
+    self.faceElemIds = None #Salome face elements (2D) of the mesh
+    self.faceElemNodesOffsets = None
+    self.faceElemNodes = None
+    self.faceElemLookup = None
+    self.elem0DIds = None
+    self.elem0DNodes = None #vertex row of each 0D element
+    self.polyFaces = {} #face node lists of the polyhedra, by cell index
+    self.nodeLookup = None
+    self.cellLookup = None #Salome volume id to PFLOTRAN cell id (0 if none)
+    return
+
+  def getNodeNumber(self):
+    return len(self.nodeIds)
+
+  def getCellNumber(self):
+    return len(self.cellIds)
+
+  def getCellNodes(self, i):
+    return self.cellNodes[self.cellNodesOffsets[i]:self.cellNodesOffsets[i+1]]
+
+  def getCellFaces(self, i):
+    start, end = self.cellFacesOffsets[i], self.cellFacesOffsets[i+1]
+    return [self.faceNodes[self.faceNodesOffsets[f]:self.faceNodesOffsets[f+1]]
+            for f in range(start, end)]
+
+  def getFaceCells(self):
+    """
+    Return the index of the cell owning each face of the face list
+    """
+    n_faces = np.diff(self.cellFacesOffsets)
+    return np.repeat(np.arange(self.getCellNumber(), dtype='i8'), n_faces)
+
+  def nodeIdsToIndexes(self, ids):
+    """
+    Convert Salome node ids to vertex rows
+    """
+    return self.nodeLookup[np.asarray(ids, dtype='i8')]
+
+  def cellIdsToPFLOTRAN(self, ids):
+    """
+    Translate Salome volume ids to PFLOTRAN cell ids (starting at 1)
+    """
+    if self.cellLookup is None:
+      self.cellLookup = np.zeros(self.cellIds.max()+1, dtype='i8')
+      self.cellLookup[self.cellIds] = np.arange(1, len(self.cellIds)+1)
+    ids = np.asarray(ids, dtype='i8')
+    res = np.take(self.cellLookup, ids, mode='clip')
+    if len(ids) and ((res == 0) | (ids >= len(self.cellLookup))).any():
+      raise RuntimeError("Some of the given elements are not volumes of the mesh")
+    return res
+
+  def getFaceElemNodes(self, ids, fill=-1):
+    """
+    Return the vertex rows of the given Salome face elements as a padded array
+    """
+    rows = self.faceElemLookup[np.asarray(ids, dtype='i8')]
+    start = self.faceElemNodesOffsets[rows]
+    sizes = self.faceElemNodesOffsets[rows+1] - start
+    width = sizes.max() if len(sizes) else 0
+    index = start[:,np.newaxis] + np.arange(width)
+    mask = np.arange(width) < sizes[:,np.newaxis]
+    nodes = np.full((len(rows), width), fill, dtype='i8')
+    nodes[mask] = self.faceElemNodes[index[mask]]
+    return nodes
+
+  def getCellBaryCenters(self):
+    """
+    Average of the cell nodes, as returned by Salome BaryCenter()
+    """
+    counts = np.diff(self.cellNodesOffsets)
+    centers = np.zeros((self.getCellNumber(),3), dtype='f8')
+    for j in range(3):
+      centers[:,j] = np.add.reduceat(self.vertices[self.cellNodes,j],
+                                     self.cellNodesOffsets[:-1])
+    return centers / counts[:,np.newaxis]
+
+  def getCellCenters(self, center0DElem=True):
+    """
+    Cell center given by the 0D element of the same rank if the mesh have
+    as many 0D elements as volumes (Voronoi meshes), barycenter else
+    """
+    if (center0DElem and self.elem0DNodes is not None and
+        len(self.elem0DNodes) == self.getCellNumber()):
+      return self.vertices[self.elem0DNodes]
+    return self.getCellBaryCenters()
+
+  def buildLookup(self):
+    self.nodeLookup = np.full(self.nodeIds.max()+1, -1, dtype='i8')
+    self.nodeLookup[self.nodeIds] = np.arange(len(self.nodeIds), dtype='i8')
+    return
+
+  def buildFaces(self):
+    """
+    Build the cell face lists from the linear element face tables and the
+    polyhedra faces
+    """
+    n_cells = self.getCellNumber()
+    n_faces = np.zeros(n_cells, dtype='i8')
+    for cellType, faces in CELL_FACES.items():
+      n_faces[self.cellTypes == cellType] = len(faces)
+    for i, faces in self.polyFaces.items():
+      n_faces[i] = len(faces)
+    self.cellFacesOffsets = np.zeros(n_cells+1, dtype='i8')
+    np.cumsum(n_faces, out=self.cellFacesOffsets[1:])
+
+    #face sizes
+    faceSizes = np.zeros(self.cellFacesOffsets[-1], dtype='i8')
+    for cellType, faces in CELL_FACES.items():
+      first = self.cellFacesOffsets[:-1][self.cellTypes == cellType]
+      for k,face in enumerate(faces):
+        faceSizes[first+k] = len(face)
+    for i, faces in self.polyFaces.items():
+      first = self.cellFacesOffsets[i]
+      faceSizes[first:first+len(faces)] = [len(x) for x in faces]
+    self.faceNodesOffsets = np.zeros(len(faceSizes)+1, dtype='i8')
+    np.cumsum(faceSizes, out=self.faceNodesOffsets[1:])
+
+    #face nodes
+    self.faceNodes = np.zeros(self.faceNodesOffsets[-1], dtype='i8')
+    for cellType, faces in CELL_FACES.items():
+      cells = np.nonzero(self.cellTypes == cellType)[0]
+      if not len(cells): continue
+      nodes = self.cellNodes[self.cellNodesOffsets[cells][:,np.newaxis] +
+                             np.arange(cellType)]
+      first = self.cellFacesOffsets[cells]
+      for k,face in enumerate(faces):
+        start = self.faceNodesOffsets[first+k]
+        self.faceNodes[start[:,np.newaxis] + np.arange(len(face))] = nodes[:,face]
+    for i, faces in self.polyFaces.items():
+      start = self.faceNodesOffsets[self.cellFacesOffsets[i]]
+      flat = np.concatenate(faces)
+      self.faceNodes[start:start+len(flat)] = flat
+    return
+
+
+
+def readDATFile(datFile):
+  """
+  Read a Salome DAT dump: nodes coordinates and element connectivities
+  Return node ids, vertices, and element ids, codes and CSR connectivity
+  """
+  src = open(datFile, 'r')
+  n_nodes, n_elements = [int(x) for x in src.readline().split()]
+  nodes = np.loadtxt(src, dtype='f8', max_rows=n_nodes, ndmin=2)
+  text = src.read()
+  src.close()
+  #elements: id, code (100*dim + number of nodes), nodes...
+  flat = np.fromstring(text, dtype='i8', sep=' ')
+  #number of values of each non empty line, from the token starts
+  chars = np.frombuffer(text.encode(), dtype='u1')
+  space = (chars == 32) | (chars == 9) | (chars == 10) | (chars == 13)
+  starts = np.flatnonzero(~space[1:] & space[:-1]) + 1
+  if len(chars) and not space[0]: starts = np.r_[0, starts]
+  sizes = np.bincount(np.searchsorted(np.flatnonzero(chars == 10), starts))
+  sizes = sizes[sizes > 0]
+  offsets = np.zeros(len(sizes)+1, dtype='i8')
+  np.cumsum(sizes, out=offsets[1:])
+  elementIds = flat[offsets[:-1]]
+  codes = flat[offsets[:-1]+1]
+  keep = np.ones(len(flat), dtype=bool)
+  keep[offsets[:-1]] = False
+  keep[offsets[:-1]+1] = False
+  connOffsets = offsets - 2*np.arange(len(offsets))
+  return (nodes[:,0].astype('i8'), nodes[:,1:4], elementIds, codes,
+          connOffsets, flat[keep])
+
+
+
+def snapshotFromMesh(mesh, verbose=True):
+  """
+  Snapshot of a Salome mesh or of a mesh of the NumPy backend (meshBackend)
+  """
+  if hasattr(mesh, "getSnapshot"):
+    return mesh.getSnapshot()
+  return snapshotFromSalomeMesh(mesh, verbose)
+
+
+
+def snapshotFromSalomeMesh(mesh, verbose=True):
+  """
+  Pull node coordinates, volume connectivities and faces out of a Salome mesh
+  in a few bulk calls. Coordinates and connectivities are read back from a
+  DAT dump of the mesh, only polyhedra faces and 0D elements are requested
+  element by element.
+  """
+  import SMESH
+  import salome
+  smesh = salome.smesh.smeshBuilder.New()
+  if not hasattr(mesh, "ExportDAT"): #meshProxy or group, get a Mesh object
+    mesh = smesh.Mesh(mesh.GetMesh())
+  snapshot = MeshSnapshot()
+  snapshot.nodeIds = np.array(mesh.GetNodesId(), dtype='i8')
+  snapshot.cellIds = np.array(mesh.GetElementsByType(SMESH.VOLUME), dtype='i8')
+  n_cells = len(snapshot.cellIds)
+
+  #dump the mesh and read it back
+  if verbose: print("Extract mesh to arrays")
+  fd, datFile = tempfile.mkstemp(suffix=".dat")
+  os.close(fd)
+  try:
+    try:
+      mesh.ExportDAT(datFile, renumber=False)
+    except TypeError: #Salome version without renumbering option
+      mesh.ExportDAT(datFile)
+    nodeIds, vertices, elementIds, codes, offsets, conn = readDATFile(datFile)
+  finally:
+    os.remove(datFile)
+  #nodes are written in the GetNodesId() order, convert connectivity to rows
+  snapshot.vertices = vertices
+  renumbered = not np.array_equal(nodeIds, snapshot.nodeIds)
+  if renumbered: conn = snapshot.nodeIds[conn-1]
+  snapshot.buildLookup()
+  conn = snapshot.nodeLookup[conn]
+
+  #keep volumes only, in the GetElementsByType() order
+  volumes = np.nonzero(codes // 100 == 3)[0]
+  if len(volumes) != n_cells:
+    raise RuntimeError("Could not match DAT volumes with the mesh volumes")
+  if not renumbered and not np.array_equal(elementIds[volumes], snapshot.cellIds):
+    lookup = np.full(max(elementIds[volumes].max(), snapshot.cellIds.max())+1,
+                     -1, dtype='i8')
+    lookup[elementIds[volumes]] = volumes
+    volumes = lookup[snapshot.cellIds]
+    if (volumes < 0).any():
+      raise RuntimeError("Could not match DAT volumes with the mesh volumes")
+  counts = offsets[volumes+1] - offsets[volumes]
+  snapshot.cellNodesOffsets = np.zeros(n_cells+1, dtype='i8')
+  np.cumsum(counts, out=snapshot.cellNodesOffsets[1:])
+  index = np.repeat(offsets[volumes] - snapshot.cellNodesOffsets[:-1], counts)
+  snapshot.cellNodes = conn[index + np.arange(snapshot.cellNodesOffsets[-1])]
+  snapshot.cellTypes = counts.copy()
+
+  #face elements, kept for group and integral flux export
+  faces = np.nonzero(codes // 100 == 2)[0]
+  counts = offsets[faces+1] - offsets[faces]
+  snapshot.faceElemIds = elementIds[faces]
+  snapshot.faceElemNodesOffsets = np.zeros(len(faces)+1, dtype='i8')
+  np.cumsum(counts, out=snapshot.faceElemNodesOffsets[1:])
+  index = np.repeat(offsets[faces] - snapshot.faceElemNodesOffsets[:-1], counts)
+  snapshot.faceElemNodes = conn[index + np.arange(snapshot.faceElemNodesOffsets[-1])]
+  if len(faces):
+    snapshot.faceElemLookup = np.full(snapshot.faceElemIds.max()+1, -1, dtype='i8')
+    snapshot.faceElemLookup[snapshot.faceElemIds] = np.arange(len(faces), dtype='i8')
+
+  #polyhedra
+  if mesh.GetMeshInfo()[SMESH.Entity_Polyhedra]:
+    criterion = smesh.GetFilter(SMESH.VOLUME, SMESH.FT_EntityType, '=',
+                                SMESH.Entity_Polyhedra)
+    polyIds = np.array(mesh.GetIdsFromFilter(criterion), dtype='i8')
+    lookup = np.full(snapshot.cellIds.max()+1, -1, dtype='i8')
+    lookup[snapshot.cellIds] = np.arange(n_cells, dtype='i8')
+    if verbose: print(f"Extract faces of {len(polyIds)} polyhedra")
+    for i,elem in zip(lookup[polyIds], polyIds):
+      snapshot.cellTypes[i] = POLYHEDRA
+      snapshot.polyFaces[i] = [snapshot.nodeIdsToIndexes(mesh.GetElemFaceNodes(elem, f))
+                               for f in range(mesh.ElemNbFaces(elem))]
+  snapshot.buildFaces()
+
+  #0D elements
+  snapshot.elem0DIds = np.array(mesh.GetElementsByType(SMESH.ELEM0D), dtype='i8')
+  if len(snapshot.elem0DIds):
+    nodes = [mesh.GetElemNodes(x)[0] for x in snapshot.elem0DIds]
+    snapshot.elem0DNodes = snapshot.nodeIdsToIndexes(nodes)
+  return snapshot
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307 USA
+#
+# Author : Moise Rousseau (2021), email at moise.rousseau@polymtl.ca
+
+import numpy as np
+
+
+
+def csrToPadded(offsets, values, fill=-1):
+  """
+  Convert a CSR connectivity to a (n, max_length) array padded with fill
+  """
+  sizes = np.diff(offsets)
+  padded = np.full((len(sizes), sizes.max() if len(sizes) else 0), fill,
+                   dtype=values.dtype)
+  mask = np.arange(padded.shape[1]) < sizes[:,np.newaxis]
+  padded[mask] = values[offsets[0]:offsets[-1]]
+  return padded
+
+
+
+def sortFaceKeys(faceNodes):
+  """
+  Sort the nodes of each face so that shared faces have the same key
+  Return the sorted keys, the order sorting the keys and the key id of
+  each face (identical faces share the same id)
+  """
+  keys = np.sort(faceNodes, axis=1)
+  #lexsort is stable: same faces stay in their original order
+  order = np.lexsort(keys.T[::-1])
+  sortedKeys = keys[order]
+  newKey = np.ones(len(order), dtype=bool)
+  newKey[1:] = np.any(sortedKeys[1:] != sortedKeys[:-1], axis=1)
+  keyId = np.empty(len(order), dtype='i8')
+  keyId[order] = np.cumsum(newKey) - 1
+  return sortedKeys, order, keyId
+
+
+
+def buildFaceTopology(faceNodes, faceCells):
+  """
+  Find faces shared by two cells from a padded face -> node array and the
+  cell of each face.
+  Return the row of the first occurrence of each internal face with the owner
+  and neighbour cells, sorted by order of first appearance, and the rows of
+  the boundary faces
+  """
+  sortedKeys, order, keyId = sortFaceKeys(faceNodes)
+  counts = np.bincount(keyId)
+  start = np.zeros(len(counts), dtype='i8')
+  np.cumsum(counts[:-1], out=start[1:])
+  #internal faces (faces shared by more than two cells are ignored)
+  shared = np.nonzero(counts == 2)[0]
+  first = order[start[shared]]
+  second = order[start[shared]+1]
+  sort = np.argsort(first, kind='stable')
+  internalFaces = first[sort]
+  owner = faceCells[internalFaces]
+  neighbour = faceCells[second[sort]]
+  #boundary faces
+  boundaryFaces = np.sort(order[start[counts == 1]])
+  return internalFaces, owner, neighbour, boundaryFaces
+
+
+
+class FaceIndex:
+  """
+  Hashed face -> (owner, neighbour) cells index built from the sorted node
+  keys of the cell faces. Faces are looked up with their node list in any
+  order, neighbour is -1 for boundary faces
+  """
+  def __init__(self, faceNodes, faceCells):
+    keys = np.ascontiguousarray(np.sort(faceNodes, axis=1))
+    self.width = keys.shape[1]
+    self.dtype = keys.dtype
+    keys = self.toVoid(keys)
+    order = np.argsort(keys, kind='stable')
+    sortedKeys = keys[order]
+    newKey = np.ones(len(order), dtype=bool)
+    newKey[1:] = sortedKeys[1:] != sortedKeys[:-1]
+    start = np.nonzero(newKey)[0]
+    counts = np.diff(np.append(start, len(order)))
+    self.keys = sortedKeys[start]
+    self.owner = faceCells[order[start]]
+    self.neighbour = np.full(len(start), -1, dtype=self.owner.dtype)
+    shared = counts >= 2
+    self.neighbour[shared] = faceCells[order[start[shared]+1]]
+    return
+
+  def toVoid(self, keys):
+    return keys.view(np.dtype((np.void, keys.dtype.itemsize*keys.shape[1]))).ravel()
+
+  def lookup(self, faceNodes, fill=-1):
+    """
+    Return the owner and neighbour cells of the faces given as a padded
+    face -> node array. Faces not found have owner -1
+    """
+    faceNodes = np.asarray(faceNodes)
+    keys = np.full((len(faceNodes), self.width), fill, dtype=self.dtype)
+    width = min(self.width, faceNodes.shape[1])
+    keys[:,:width] = faceNodes[:,:width]
+    keys = self.toVoid(np.ascontiguousarray(np.sort(keys, axis=1)))
+    pos = np.searchsorted(self.keys, keys)
+    pos[pos == len(self.keys)] = 0
+    found = self.keys[pos] == keys
+    if faceNodes.shape[1] > self.width:
+      found &= (faceNodes[:,self.width:] == fill).all(axis=1)
+    owner = np.where(found, self.owner[pos], -1)
+    neighbour = np.where(found, self.neighbour[pos], -1)
+    return owner, neighbour
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307 USA
+#
+# Author : Moise Rousseau (2021), email at moise.rousseau@polymtl.ca
+
+"""
+Export meshes to PFLOTRAN without the Salome GUI, for example:
+
+  salome shell -- python3 pflotran_export.py mesh.med -o out.h5 \
+                  --format hdf5 --grid implicit --groups rock bottom
+
+Input meshes are MED or UNV files, or Salome Python dumps (the meshes
+defined in the script are exported). Several inputs are exported in
+parallel processes with --jobs.
+With --backend numpy, meshes are read with meshio (MED, VTK, Gmsh...) and
+exported in a plain Python process without Salome:
+
+  python3 pflotran_export.py mesh.msh -o out.uge --format ascii \
+                             --grid explicit --backend numpy
+"""
+
+import os
+import sys
+import time
+import argparse
+import runpy
+
+PLUGIN_PATH = os.path.dirname(os.path.abspath(__file__))
+for folder in ["", "PFLOTRAN_mesh_export"]:
+  if os.path.join(PLUGIN_PATH, folder) not in sys.path:
+    sys.path.append(os.path.join(PLUGIN_PATH, folder))
+
+import meshBackend
+
+OUTPUT_FORMATS = {"hdf5":1, "ascii":2}
+GRID_FORMATS = {"implicit":1, "explicit":2, "polyhedra":3}
+EXTENSIONS = {(1,1):".h5", (1,2):".h5", (1,3):".h5",
+              (2,1):".ugi", (2,2):".uge", (2,3):".ugp"}
+
+
+
+def loadMeshes(meshFile, meshName=None, backend="salome"):
+  """
+  Load the meshes of a MED, UNV or Salome Python dump file
+  Return a list of smeshBuilder.Mesh objects, or of meshBackend.ArrayMesh
+  for the numpy backend
+  """
+  if backend == "numpy":
+    meshes = [meshBackend.readMesh(meshFile)]
+  else:
+    meshes = loadSalomeMeshes(meshFile)
+  if meshName is not None:
+    meshes = [x for x in meshes if x.GetName() == meshName]
+  if not meshes:
+    raise RuntimeError("No mesh to export found in " + meshFile)
+  return meshes
+
+
+
+def loadSalomeMeshes(meshFile):
+  import salome
+  salome.salome_init()
+  from salome.smesh import smeshBuilder
+  smesh = smeshBuilder.New()
+  ext = os.path.splitext(meshFile)[1].lower()
+  if ext == ".med":
+    meshes, status = smesh.CreateMeshesFromMED(meshFile)
+  elif ext == ".unv":
+    meshes = [smesh.CreateMeshesFromUNV(meshFile)]
+  elif ext == ".py": #Salome dump
+    variables = runpy.run_path(meshFile, run_name="__main__")
+    meshes = [x for x in variables.values() if isinstance(x, smeshBuilder.Mesh)]
+  else:
+    raise RuntimeError("Unknown mesh file format: " + meshFile)
+  return meshes
+
+
+
+def getGroupsToExport(mesh, groupNames=None):
+  """
+  Return the [group, region name] of the volume and face groups of the mesh
+  All groups are returned if groupNames is ["all"]
+  """
+  groups = [x for x in mesh.GetGroups() if x.GetType() in
+            [meshBackend.VOLUME, meshBackend.FACE]]
+  if not groupNames:
+    return []
+  if groupNames != ["all"]:
+    missing = set(groupNames) - set(x.GetName() for x in groups)
+    if missing:
+      print("Group(s) not found in mesh {}: {}".format(mesh.GetName(), " ".join(missing)))
+    groups = [x for x in groups if x.GetName() in groupNames]
+  return [[x, x.GetName()] for x in groups]
+
+
+
+def exportMeshFile(meshFile, output, options):
+  """
+  Export all the meshes in meshFile with the exporters of the Salome plugin
+  output is the output file if the file contains one mesh, the output
+  folder else
+  """
+  import exportSession
+  import exportMesh
+  import exportSubMesh
+  tt = time.time()
+  outFormat = OUTPUT_FORMATS[options["format"]]
+  gridFormat = GRID_FORMATS[options["grid"]]
+  meshes = loadMeshes(meshFile, options["mesh_name"], options["backend"])
+  for mesh in meshes:
+    if len(meshes) == 1 and not os.path.isdir(output):
+      folder, name = os.path.split(output)
+    else:
+      folder, name = output, mesh.GetName() + EXTENSIONS[(outFormat,gridFormat)]
+    if folder and not os.path.isdir(folder):
+      os.makedirs(folder)
+    folder = os.path.join(folder, "")
+    print("Export mesh: {} to {}".format(mesh.GetName(), folder+name))
+    session = exportSession.ExportSession(mesh)
+    exportMesh.meshToPFLOTRAN(mesh, folder, outFormat, gridFormat, name,
+                              options["compress"], n_workers=options["n_workers"],
+                              session=session)
+    groupsToExport = getGroupsToExport(mesh, options["groups"])
+    if groupsToExport and outFormat == 1 and gridFormat == 1:
+      h5Options = {}
+      if options["compress"]:
+        h5Options = {"compression":"gzip", "shuffle":True}
+      exportSubMesh.regionsToPFLOTRANHDF5(groupsToExport, folder+name, session, **h5Options)
+    else:
+      for group, groupName in groupsToExport:
+        exportSubMesh.submeshToPFLOTRAN(group, groupName, folder, name, outFormat,
+                                        gridFormat, session=session)
+  print("{} exported in {:.2f} s".format(meshFile, time.time()-tt))
+  return meshFile
+
+
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description="Export Salome meshes to PFLOTRAN grids")
+  parser.add_argument("inputs", nargs="+", help="MED, UNV or Salome Python dump mesh files (any meshio format with the numpy backend)")
+  parser.add_argument("-o", "--output", default=".",
+                      help="output file for a single mesh, output folder else, created if missing (default: .)")
+  parser.add_argument("--format", choices=list(OUTPUT_FORMATS), default="hdf5")
+  parser.add_argument("--grid", choices=list(GRID_FORMATS), default="implicit")
+  parser.add_argument("--groups", nargs="*", default=None,
+                      help="groups to export as regions, 'all' for every group")
+  parser.add_argument("--mesh-name", default=None, help="export only the mesh with this name")
+  parser.add_argument("--backend", choices=["salome", "numpy"], default=None,
+                      help="mesh reader, salome if available, numpy (meshio) else")
+  parser.add_argument("--compress", action="store_true", help="compress HDF5 output")
+  parser.add_argument("--jobs", type=int, default=1,
+                      help="number of mesh files exported in parallel")
+  parser.add_argument("--n-workers", type=int, default=1,
+                      help="processes computing the explicit grid geometry of each mesh")
+  args = parser.parse_args(argv)
+  options = vars(args)
+  if args.backend is None:
+    try:
+      import salome
+      options["backend"] = "salome"
+    except ImportError:
+      options["backend"] = "numpy"
+
+  if len(args.inputs) > 1:
+    if os.path.exists(args.output) and not os.path.isdir(args.output):
+      parser.error("output must be a folder when exporting several files")
+    os.makedirs(args.output, exist_ok=True)
+  if args.jobs > 1 and args.n_workers > 1:
+    print("Warning: --jobs and --n-workers both greater than 1, {} processes will be used".format(args.jobs*args.n_workers))
+
+  if args.jobs <= 1 or len(args.inputs) == 1:
+    for meshFile in args.inputs:
+      exportMeshFile(meshFile, args.output, options)
+  else:
+    #one Salome session in each process
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+      futures = [executor.submit(exportMeshFile, x, args.output, options) for x in args.inputs]
+      failed = 0
+      for meshFile, future in zip(args.inputs, futures):
+        try:
+          print("Done: " + future.result())
+        except Exception as e:
+          print("Export failed: {}: {}".format(meshFile, e))
+          failed += 1
+    if failed:
+      print("{} / {} export(s) failed".format(failed, len(args.inputs)))
+      return 1
+  return 0
+
+
+
+if __name__ == '__main__':
+  sys.exit(main())
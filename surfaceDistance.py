@@ -0,0 +1,315 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307 USA
+#
+# Author : Moise Rousseau (2021), email at moise.rousseau@polymtl.ca
+
+"""
+Exact distance from many points to a triangulated surface. Surface faces
+are split in triangles stored in a bounding volume hierarchy (triangles
+sorted along a Morton curve, grouped in leaves and boxes merged two by two
+up to the root). The hierarchy is traversed level by level for a whole
+batch of points at once, boxes farther than the best distance found so far
+being discarded.
+"""
+
+import numpy as np
+
+
+
+def triangulateFaces(faceNodes):
+  """
+  Split the faces of a (n_faces, max_face_size) array padded with -1 in
+  triangles (fan from the first node). Return a (n_triangles, 3) array
+  """
+  faceNodes = np.asarray(faceNodes)
+  sizes = (faceNodes >= 0).sum(axis=1)
+  triangles = []
+  for k in range(1, faceNodes.shape[1]-1):
+    faces = sizes > k+1
+    triangles.append(np.stack([faceNodes[faces,0], faceNodes[faces,k],
+                               faceNodes[faces,k+1]], axis=1))
+  if not triangles:
+    return np.zeros((0,3), dtype=faceNodes.dtype)
+  return np.concatenate(triangles)
+
+
+
+def mortonCodes(points, bits=10):
+  """
+  Morton code of points, coordinates being quantized on bits bits in their
+  bounding box
+  """
+  lower = points.min(axis=0)
+  extent = points.max(axis=0) - lower
+  extent[extent == 0.] = 1.
+  q = ((points - lower) / extent * (2**bits - 1)).astype('i8')
+  codes = np.zeros(len(points), dtype='i8')
+  for b in range(bits):
+    for j in range(3):
+      codes |= ((q[:,j] >> b) & 1) << (3*b + j)
+  return codes
+
+
+
+def closestPointOnTriangles(P, A, B, C):
+  """
+  Closest point to P on triangles ABC, all arguments being (n,3) arrays
+  (Ericson, Real-Time Collision Detection, 2005, section 5.1.5)
+  """
+  AB = B - A
+  AC = C - A
+  AP = P - A
+  BP = P - B
+  CP = P - C
+  d1 = np.einsum('ij,ij->i', AB, AP)
+  d2 = np.einsum('ij,ij->i', AC, AP)
+  d3 = np.einsum('ij,ij->i', AB, BP)
+  d4 = np.einsum('ij,ij->i', AC, BP)
+  d5 = np.einsum('ij,ij->i', AB, CP)
+  d6 = np.einsum('ij,ij->i', AC, CP)
+  va = d3*d6 - d5*d4
+  vb = d5*d2 - d1*d6
+  vc = d1*d4 - d3*d2
+  with np.errstate(divide='ignore', invalid='ignore'):
+    #inside the triangle
+    denom = va + vb + vc
+    v = vb / denom
+    w = vc / denom
+    Q = A + v[:,np.newaxis]*AB + w[:,np.newaxis]*AC
+    #edges, in reverse order of priority
+    t = (d4 - d3) / ((d4 - d3) + (d5 - d6))
+    mask = (va <= 0) & (d4 - d3 >= 0) & (d5 - d6 >= 0)
+    Q[mask] = (B + t[:,np.newaxis]*(C - B))[mask]
+    t = d2 / (d2 - d6)
+    mask = (vb <= 0) & (d2 >= 0) & (d6 <= 0)
+    Q[mask] = (A + t[:,np.newaxis]*AC)[mask]
+    t = d1 / (d1 - d3)
+    mask = (vc <= 0) & (d1 >= 0) & (d3 <= 0)
+    Q[mask] = (A + t[:,np.newaxis]*AB)[mask]
+  #vertices
+  mask = (d6 >= 0) & (d5 <= d6)
+  Q[mask] = C[mask]
+  mask = (d3 >= 0) & (d4 <= d3)
+  Q[mask] = B[mask]
+  mask = (d1 <= 0) & (d2 <= 0)
+  Q[mask] = A[mask]
+  #degenerated triangles
+  mask = ~np.isfinite(Q).all(axis=1)
+  Q[mask] = A[mask]
+  return Q
+
+
+
+def boxBounds(points, lower, upper):
+  """
+  Squared distance from points to the boxes given by their lower and upper
+  corners, and to their farthest corner (inf for empty boxes)
+  """
+  below = lower - points
+  above = points - upper
+  farthest = np.maximum(np.abs(below), np.abs(above))
+  np.maximum(below, above, out=below)
+  np.maximum(below, 0., out=below)
+  return np.einsum('ij,ij->i', below, below), np.einsum('ij,ij->i', farthest, farthest)
+
+
+
+def groupStarts(ids):
+  """
+  First position of each group of a sorted id array
+  """
+  return np.r_[0, np.flatnonzero(ids[1:] != ids[:-1]) + 1]
+
+
+
+def groupMinimum(values, ids):
+  """
+  Position of the minimum value of each group of a sorted id array
+  """
+  starts = groupStarts(ids)
+  minimum = np.repeat(np.minimum.reduceat(values, starts), np.diff(np.append(starts, len(ids))))
+  first = np.flatnonzero(values == minimum)
+  return first[groupStarts(ids[first])]
+
+
+
+class SurfaceDistance:
+  """
+  Distance to the surface defined by the vertices and the padded face
+  array faceNodes (triangles, quadrangles or polygons)
+  """
+  def __init__(self, vertices, faceNodes, leafSize=8):
+    self.vertices = np.asarray(vertices, dtype='f8')
+    triangles = triangulateFaces(faceNodes)
+    if not len(triangles):
+      raise RuntimeError("Surface has no face to compute distance to")
+    points = self.vertices[triangles]
+    order = np.argsort(mortonCodes(points.mean(axis=1)), kind='stable')
+    self.triangles = triangles[order]
+    self.leafSize = leafSize
+    #triangle boxes, padded to a power of two leaves with empty boxes
+    n_leaves = -(-len(triangles) // leafSize)
+    self.depth = int(np.ceil(np.log2(n_leaves))) if n_leaves > 1 else 0
+    self.triangleLower = np.full((2**self.depth * leafSize, 3), np.inf)
+    self.triangleUpper = np.full((2**self.depth * leafSize, 3), -np.inf)
+    self.triangleLower[:len(triangles)] = points.min(axis=1)[order]
+    self.triangleUpper[:len(triangles)] = points.max(axis=1)[order]
+    #boxes of each level, from the root to the leaves
+    self.lower = [self.triangleLower.reshape(-1, leafSize, 3).min(axis=1)]
+    self.upper = [self.triangleUpper.reshape(-1, leafSize, 3).max(axis=1)]
+    for level in range(self.depth):
+      self.lower.insert(0, self.lower[0].reshape(-1, 2, 3).min(axis=1))
+      self.upper.insert(0, self.upper[0].reshape(-1, 2, 3).max(axis=1))
+    return
+
+  def getTriangleNumber(self):
+    return len(self.triangles)
+
+  def distanceToTriangles(self, points, triangles):
+    """
+    Distance and vector from points to the closest point of the triangles
+    (both of the same length)
+    """
+    A, B, C = [self.vertices[self.triangles[triangles,j]] for j in range(3)]
+    vector = closestPointOnTriangles(points, A, B, C) - points
+    return np.sqrt(np.einsum('ij,ij->i', vector, vector)), vector
+
+  def distanceToLeaves(self, points, pointIds, leaves, bound, distance, vector):
+    """
+    Update distance and vector of points with the triangles of the leaves
+    whose box is within the squared distance bound. pointIds is the point of
+    each leaf and must be sorted
+    """
+    triangles = (leaves[:,np.newaxis] * self.leafSize + np.arange(self.leafSize)).ravel()
+    pointIds = np.repeat(pointIds, self.leafSize)
+    lower, upper = boxBounds(points[pointIds], self.triangleLower[triangles],
+                             self.triangleUpper[triangles])
+    upper[triangles >= self.getTriangleNumber()] = np.inf
+    #exact distance to the triangle with the nearest farthest corner first
+    first = groupMinimum(upper, pointIds)
+    self.updateDistance(points, pointIds[first], triangles[first], distance, vector)
+    bound = np.minimum(bound[pointIds], distance[pointIds]**2)
+    keep = lower <= bound
+    keep[first] = False
+    triangles, pointIds = triangles[keep], pointIds[keep]
+    if len(triangles):
+      self.updateDistance(points, pointIds, triangles, distance, vector)
+    return
+
+  def updateDistance(self, points, pointIds, triangles, distance, vector):
+    """
+    Update distance and vector of points with the triangles when closer.
+    pointIds is the point of each triangle and must be sorted
+    """
+    d, v = self.distanceToTriangles(points[pointIds], triangles)
+    first = groupMinimum(d, pointIds)
+    better = d[first] < distance[pointIds[first]]
+    first = first[better]
+    distance[pointIds[first]] = d[first]
+    vector[pointIds[first]] = v[first]
+    return
+
+  def query(self, points, chunkSize=10000, maxDistance=np.inf):
+    """
+    Return the distance from the points to the surface and the vector from
+    the points to their closest point on the surface. Points are processed
+    by chunk of chunkSize. Points farther than maxDistance are not computed,
+    their distance is inf and their vector null
+    """
+    points = np.asarray(points, dtype='f8')
+    distance = np.zeros(len(points), dtype='f8')
+    vector = np.zeros((len(points),3), dtype='f8')
+    for start in range(0, len(points), chunkSize):
+      end = min(start+chunkSize, len(points))
+      distance[start:end], vector[start:end] = self.queryChunk(points[start:end], maxDistance)
+    far = distance > maxDistance
+    distance[far] = np.inf
+    vector[far] = 0.
+    return distance, vector
+
+  def queryChunk(self, points, maxDistance=np.inf):
+    n_points = len(points)
+    distance = np.full(n_points, np.inf)
+    vector = np.zeros((n_points,3), dtype='f8')
+    pointIds = np.arange(n_points)
+    if maxDistance == np.inf:
+      #first guess: descend to the child box with the nearest center
+      nodes = np.zeros(n_points, dtype='i8')
+      for level in range(1, self.depth+1):
+        children = np.stack([2*nodes, 2*nodes+1], axis=1)
+        with np.errstate(invalid='ignore'):
+          center = (self.lower[level][children] + self.upper[level][children]) / 2
+        d = ((center - points[:,np.newaxis,:])**2).sum(axis=2)
+        d[np.isnan(d)] = np.inf #empty box
+        nodes = children[pointIds, np.argmin(d, axis=1)]
+      self.distanceToLeaves(points, pointIds, nodes, np.full(n_points, np.inf), distance, vector)
+    #all the boxes that could hold a closer triangle. Each box holds at least
+    #a triangle, so its farthest corner also bounds the distance
+    bound = np.minimum(distance**2, maxDistance**2)
+    nodes = np.zeros(n_points, dtype='i8')
+    for level in range(self.depth+1):
+      lower, upper = boxBounds(points[pointIds], self.lower[level][nodes],
+                               self.upper[level][nodes])
+      starts = groupStarts(pointIds)
+      bound[pointIds[starts]] = np.minimum(bound[pointIds[starts]],
+                                           np.minimum.reduceat(upper, starts))
+      keep = lower <= bound[pointIds]
+      pointIds, nodes = pointIds[keep], nodes[keep]
+      if level < self.depth:
+        pointIds = np.repeat(pointIds, 2)
+        nodes = (2*nodes[:,np.newaxis] + np.arange(2)).ravel()
+    if len(pointIds):
+      self.distanceToLeaves(points, pointIds, nodes, bound, distance, vector)
+    return distance, vector
+
+
+
+#surface of the query worker processes
+workerData = {}
+
+def initQueryWorker(engine):
+  workerData["engine"] = engine
+  return
+
+def queryWorkerChunk(points, maxDistance):
+  return workerData["engine"].query(points, maxDistance=maxDistance)
+
+
+
+def queryChunks(engine, chunks, n_workers=1, maxDistance=np.inf):
+  """
+  Yield the distance and vector of the points of each chunk to the surface
+  of engine (a SurfaceDistance), in the order of chunks. Chunks are computed
+  by n_workers processes, at most 2*n_workers chunks waiting in memory
+  """
+  if n_workers <= 1:
+    for points in chunks:
+      yield engine.query(points, maxDistance=maxDistance)
+    return
+  from collections import deque
+  from concurrent.futures import ProcessPoolExecutor
+  #the surface is sent once to each worker
+  with ProcessPoolExecutor(max_workers=n_workers, initializer=initQueryWorker,
+                           initargs=(engine,)) as executor:
+    pending = deque()
+    for points in chunks:
+      pending.append(executor.submit(queryWorkerChunk, points, maxDistance))
+      if len(pending) >= 2*n_workers:
+        yield pending.popleft().result()
+    while pending:
+      yield pending.popleft().result()
+  return
@@ -0,0 +1,36 @@
+import os
+import sys
+import numpy as np
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [root, os.path.join(root, "PFLOTRAN_mesh_export")]
+
+import meshio
+import meshBackend
+import exportMesh
+
+
+def jitteredBoxSnapshot(n=4, seed=0):
+  x = np.linspace(0., 1., n+1)
+  X, Y, Z = np.meshgrid(x, x, x, indexing='ij')
+  points = np.stack([X.ravel(), Y.ravel(), Z.ravel()], axis=1)
+  points += np.random.default_rng(seed).uniform(-0.2/n, 0.2/n, points.shape)
+  idx = np.arange(len(points)).reshape(n+1, n+1, n+1)
+  hexa = [[idx[i,j,k], idx[i+1,j,k], idx[i+1,j+1,k], idx[i,j+1,k],
+           idx[i,j,k+1], idx[i+1,j,k+1], idx[i+1,j+1,k+1], idx[i,j+1,k+1]]
+          for i in range(n) for j in range(n) for k in range(n)]
+  mesh = meshBackend.meshFromMeshio(meshio.Mesh(points, [("hexahedron", np.array(hexa))]))
+  return mesh.getSnapshot()
+
+
+def test_projected_area_positive_and_smaller():
+  snapshot = jitteredBoxSnapshot()
+  owner, neighbour, area, center = exportMesh.buildInternalFaces(snapshot)
+  owner_p, neighbour_p, projected, center_p = exportMesh.buildInternalFaces(
+                                                 snapshot, project_area=True)
+  assert np.array_equal(owner, owner_p) and np.array_equal(neighbour, neighbour_p)
+  assert len(area) == 3 * 4 * 4 * 3
+  assert (area > 0).all()
+  assert (projected > 0).all()
+  assert (projected <= area * (1 + 1e-12)).all()
+  assert (projected < area).any()